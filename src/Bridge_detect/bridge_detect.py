@@ -10,6 +10,9 @@ from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 import math
 import traceback
+from autobebop.debug_images import DebugImage, set_rate
+from autobebop.image_cache import ImageCache
+from autobebop.profiling import Profiler
 
 master_mission_no = 0
 
@@ -18,6 +21,12 @@ master_mission_no = 0
 ###############
 bridge = CvBridge()
 
+# gray and color images of the last few messages
+images = ImageCache()
+
+# stage latencies, published on /diagnostics with ~profile
+profiler = Profiler('bridge_detect')
+
 # observation factors for camera (tuning param), should not be necessary if camera is properly calibrated and pnp is working
 obs_factor_x = 1.8
 obs_factor_y = 1.8
@@ -39,12 +48,15 @@ img = np.zeros((480,640,3), np.uint8)
 #ros Images
 raw_image = Image()
 frame = Image()
-edges = Image()
-dilatedEdges = Image()
-bridgemask = Image()
-corners = Image()
 orig_frame = Image()
-filledBridge = Image()
+
+# stages of the bridge mask, only serialized while they have subscribers
+debug_edges = DebugImage('/edges_image', "8UC1")
+debug_dilatedEdges = DebugImage('/dilatedEdges_image', "8UC1")
+debug_bridgemask = DebugImage('/bridgemask_image', "8UC1")
+debug_filledBridge = DebugImage('/filledBridge_image', "8UC1")
+debug_corners = DebugImage('/corners_image', "8UC1")
+debug_orig_frame = DebugImage('/orig_frame_image', "8UC1")
 
 #relative pose
 pose_rel = Odometry()
@@ -176,11 +188,13 @@ def scaleImage(frame):
     frame = cv2.resize(frame, dim, interpolation = cv2.INTER_AREA)
     return frame
 
+@profiler.timed('getEdges')
 def getEdges(frame):
     #find edges in image
     frame = cv2.Canny(frame,0,150) #tune second parameter for more/less agressive detection
     return frame
 
+@profiler.timed('firstDilate')
 def firstDilate(frame):
     #dilate/erode edges
     kernel = np.ones((5,5), np.uint8)
@@ -192,6 +206,7 @@ def firstDilate(frame):
     # frame = cv2.dilate(frame, kernel, iterations=1)
     return frame
 
+@profiler.timed('featurelessThresh')
 def featurelessThresh(frame):
     #simple threshhold on featureless areas; if featureless area is too dark, likely not bridge
 	frame[np.where(frame == 255)] = orig_frame[np.where(frame == 255)]
@@ -206,6 +221,7 @@ def featurelessThresh(frame):
 	frame = cv2.erode(frame, kernel, iterations=1)
 	return frame
 
+@profiler.timed('fillBridge')
 def fillBridge(frame,areas,idxs,cntsSorted):
     #draw largest contour and erode
     frame = cv2.drawContours(frame, [cntsSorted[-1]], 0, 255, thickness=cv2.FILLED)
@@ -221,6 +237,7 @@ def fillBridge(frame,areas,idxs,cntsSorted):
     frame = cv2.drawContours(frame, [hull], 0, 255, thickness=cv2.FILLED)   
     return frame, hull, areas, idxs, cntsSorted
 
+@profiler.timed('fitPoly')
 def fitPoly(frame,hull):
     #fit polygon
     peri = cv2.arcLength(hull, True)
@@ -229,6 +246,7 @@ def fitPoly(frame,hull):
     frame = cv2.drawContours(frame, [approx], 0, 255, thickness=cv2.FILLED) 
     return frame
 
+@profiler.timed('getBridgeCenter')
 def getBridgeCenter(frame):
     #find 4 corners of bridge and sort them clockwise from top left corner
     corners = cv2.goodFeaturesToTrack(frame,4,0.01,80) #pick out 4 most prominant corners
@@ -285,6 +303,7 @@ def getBridgeCenter(frame):
 	        slope  = (slope1 + slope2)/2  
     return frame,cX_bridge,cY_bridge,slope
 
+@profiler.timed('getBridgeWaypoints')
 def getBridgeWaypoints(orig_frame,slope,cX_bridge,cY_bridge):
     #draw direction
     signX = 1.0
@@ -382,16 +401,12 @@ def get_master_mission(data):
 
 pub_pose_bridge_in = rospy.Publisher('/pose_bridge_in', Odometry, queue_size=10)
 def main():
-	global edges, dilatedEdges, bridgemask, filledBridge, corners, orig_frame, pub_pose_rel
+	global orig_frame, pub_pose_rel
 	rospy.init_node('bridge_detect', anonymous=True)
 
 	pub_pose_rel = rospy.Publisher('/pose_rel_bridge', Odometry, queue_size=10)
-	pub_edges_image = rospy.Publisher('/edges_image', Image, queue_size=10)
-	pub_dilatedEdges_image = rospy.Publisher('/dilatedEdges_image', Image, queue_size=10)
-	pub_bridgemask_image = rospy.Publisher('/bridgemask_image', Image, queue_size=10)
-	pub_filledBridge_image = rospy.Publisher('/filledBridge_image', Image, queue_size=10)
-	pub_corners_image = rospy.Publisher('/corners_image', Image, queue_size=10)
-	pub_orig_frame_image = rospy.Publisher('/orig_frame_image', Image, queue_size=10)
+	set_rate([debug_edges, debug_dilatedEdges, debug_bridgemask, debug_filledBridge, debug_corners, debug_orig_frame],
+		rospy.get_param('~debug_rate', 5.0))
 
 	rospy.Subscriber('/duo3d/left/image_rect', Image, callback) #should be faster than 20Hz or the rate of publishing below, else EKF might get fucked up
 	rospy.Subscriber('/pose_in', Odometry, quad_pose)
@@ -399,47 +414,43 @@ def main():
 
 	cX_bridge_prev = cY_bridge_prev = xb_past_prev = yb_past_prev = xb_b4_prev = yb_b4_prev = theta_prev = 0.0
 
+	if rospy.get_param('~profile', False):
+		profiler.start(rospy.get_param('~profile_period', 5.0))
+
 	rate = rospy.Rate(20)
 	while not rospy.is_shutdown():
 
 		if (master_mission_no == 2):
+			profiler.frame(raw_image.header)
+			tic = time.time()
 
 			try: 
-				#get image
-				try:
-					frame = bridge.imgmsg_to_cv2(raw_image, "bgr8")
-				except CvBridgeError as e:
-					print(e)
-
-				frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+				#get gray image, read from the message without conversion for mono8
+				frame = images.gray(raw_image)
 
 				#scale image if needed
 				frame = scaleImage(frame)
 				#frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
 				# frame = cv2.flip(frame,1)
-				orig_frame = np.copy(frame)
+				# not copied, the stages below return new images
+				orig_frame = frame
 
 				#get edges of image
 				frame = getEdges(frame)
-				edges = np.copy(frame) #for plotting and troubleshooting, comment out in final implimentation
-				edges = bridge.cv2_to_imgmsg(edges, "8UC1")
-				pub_edges_image.publish(edges)
+				debug_edges.publish(frame)
 
 				#dilate edges to fill in featured areas
 				frame = firstDilate(frame)
-				dilatedEdges = np.copy(frame) #for plotting and troubleshooting, comment out in final implimentation
-				dilatedEdges = bridge.cv2_to_imgmsg(dilatedEdges, "8UC1")
-				pub_dilatedEdges_image.publish(dilatedEdges)
+				debug_dilatedEdges.publish(frame)
 
 				#of featurelss areas, take only areas of high brightness
 				frame = featurelessThresh(frame)
-				bridgemask = np.copy(frame) #for plotting and troubleshooting, comment out in final implimentation   
-				bridgemask = bridge.cv2_to_imgmsg(bridgemask, "8UC1")
-				pub_bridgemask_image.publish(bridgemask)
+				debug_bridgemask.publish(frame)
 
 				#do some stuff if we detect something that could be a bridge
 				#find all contours of mask
-				_,contours,_ = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+				with profiler.stage('findContours'):
+					_,contours,_ = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 				frame = np.zeros(shape=[height,width, 1], dtype=np.uint8)
 				max_contour_ratio = .02  #change based on relative size of bridge in frame 
 
@@ -453,18 +464,14 @@ def main():
 				    if areas[idxs[-1]] > max_contour_ratio*height*width: 
 				        #fill all concave corners of biggest bridge contour
 				        frame, hull, areas, idxs, cntsSorted = fillBridge(frame,areas,idxs,cntsSorted)
-				        filledBridge = np.copy(frame) #for plotting and troubleshooting, comment out in final implimentation
-				        filledBridge = bridge.cv2_to_imgmsg(filledBridge, "8UC1")
-				        pub_filledBridge_image.publish(filledBridge)
+				        debug_filledBridge.publish(frame)
 
 				        #fit polygon to bridge
 				        frame = fitPoly(frame,hull)
-				        fittedRectangle = np.copy(frame) #for plotting and troubleshooting, comment out in final implimentation
 				        
 				        #get center of bridge and its slope
 				        corners,cX_bridge,cY_bridge,slope = getBridgeCenter(frame) #corners is image of 4 found corners of bridge, not needed
-				        corners = bridge.cv2_to_imgmsg(np.asarray(corners), "8UC1")
-				        pub_corners_image.publish(corners)
+				        debug_corners.publish(corners)
 
 				        #get waypoint before and on other side of bridge
 				        orig_frame,x_past,y_past,x_b4,y_b4 = getBridgeWaypoints(orig_frame,slope,cX_bridge,cY_bridge) #orig_frame is original image with detected center and direction
@@ -491,8 +498,8 @@ def main():
 				        get_pose(cX_bridge,cY_bridge,theta)
 				        pose_cam2in(theta)     
 
-				orig_frame2 = bridge.cv2_to_imgmsg(orig_frame, "8UC1")
-				pub_orig_frame_image.publish(orig_frame2)
+				debug_orig_frame.publish(orig_frame)
+				profiler.record('frame', time.time() - tic)
 
 
 			except Exception:
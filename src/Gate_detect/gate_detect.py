@@ -10,6 +10,12 @@ from nav_msgs.msg import Odometry
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 from decimal import Decimal
+from autobebop.camera_model import CameraModel, default_calibration
+from autobebop import gate_segmentation
+from autobebop.debug_images import DebugImage, set_rate
+from autobebop.image_cache import ImageCache, to_full
+from autobebop import planar_pnp
+from autobebop.profiling import Profiler
 
 master_mission_no = 0
 
@@ -29,107 +35,183 @@ x = y = z = vx = vy = vz = roll = pitch = yaw = 0.0
 
 pose_rel = Odometry()
 
+# pose of the last accepted detection, the warm start of the next one while the gate is tracked
+rotation_pnp = None
+translation_pnp = None
+# 6x6 covariance of (translation_pnp, rotation_pnp)
+pose_covariance = np.zeros((6,6))
+
+# rejection of poses reprojecting worse than max_reproj_error pixels (~max_reproj_error) or
+# moving more than max_jump m / max_jump_angle rad from the tracked pose (~max_jump, ~max_jump_angle)
+max_reproj_error = 4.0
+max_jump = 0.5
+max_jump_angle = 0.5
+pixel_sigma = 1.0 # corner noise (pixels) of the covariance, ~pixel_sigma
+
 img = np.zeros((480,640,3), np.uint8)
 raw_image = Image()
-bin_image = Image()
-contour_image = Image()
-corner_image = Image()
-pose_image = Image()
 debug_image = Image()
 
-bridge = CvBridge()
-
-pose_gate_in = Odometry()
+# detection stages, only drawn while they have subscribers
+debug_bin = DebugImage('/bin_image', "8UC1")
+debug_contour = DebugImage('/contour_image', "8UC1")
+debug_corner = DebugImage('/corner_image', "8UC3")
+debug_pose = DebugImage('/pose_image_txt', "8UC3")
 
-def remove_distortion(img):
-	width  = img.shape[1]
-	height = img.shape[0]
-
-	dist_coeffs = np.array([-0.271345, 0.06, -0.000446, -0.000109, 0.0]) #get from camera calibration
-
-	# assume unit matrix for camera
-	cam = np.eye(3,dtype=np.float32)
+bridge = CvBridge()
 
-	cam[0,2] = width/2.0  # define center x
-	cam[1,2] = height/2.0 # define center y
+# gray and color images of the last few messages
+images = ImageCache()
 
-	focal_length_x = 353.939474 #get from camera calibration
-	focal_length_y = 353.169928 #get from camera calibration
-	cam[0,0] = focal_length_x        # define focal length x
-	cam[1,1] = focal_length_y        # define focal length y
+# stage latencies, published on /diagnostics with ~profile
+profiler = Profiler('gate_detect')
 
-	img = cv2.undistort(img,cam,dist_coeffs)
+pose_gate_in = Odometry()
 
-	return img
+# level of the image pyramid the gate is segmented at (0 full resolution, 1 half, ...), ~pyramid_level
+pyramid_level = 0
+scale = 1.0
+
+def kernel(size):
+	# size x size structuring element at full resolution, shrunk to the working level
+	size = max(1, int(round(size*scale)))
+	return np.ones((size,size), np.uint8)
+
+# calibrated camera, ~calibration (camera_info YAML)
+camera = CameraModel.from_yaml()
+
+# undistort the whole frame before segmenting it (~undistort_frame), by default
+# only the corners are undistorted, inside solvePnP
+undistort_frame = False
+
+# yellow of the gate (~color_model 'box' / 'gaussian', or a table trained offline, ~color_lut)
+color_model = gate_segmentation.color_model()
+
+# colour mask of the frame, published for gate_detect_cross while it listens (made in main)
+pub_gate_mask = None
+
+# ROI tracking (~track_roi): once the gate is found only a region around the last
+# corners, or around the projected /pose_gate_in_filtered after a miss, is
+# segmented, the whole frame again after ~track_misses frames without the gate
+track_roi = False
+track_misses = 5
+roi_margin = 0.5 # fraction of the gate size added on every side of its box, ~roi_margin
+misses = track_misses # frames since the last detection
+last_corners = None # (row, col) full resolution corners of the last detection
+pose_gate_filtered = None
+roi = None # (x0, y0, x1, y1) working level region segmented this frame, None for the whole frame
+
+def remove_distortion(img, roi=None):
+	# img at the working level, through the precomputed maps of the level
+	return camera.remap(img, pyramid_level, roi)
+
+def project_gate(pose):
+	# full resolution (x, y) pixels of the gate corners at the inertial pose, seen from the current quad pose (inverse of pose_cam2in)
+	dx = pose.pose.pose.position.x - x
+	dy = pose.pose.pose.position.y - y
+	dz = pose.pose.pose.position.z - z
+
+	# inertial to body frame, body to camera frame
+	x_obj_rel_b = dx*cos(yaw) + dy*sin(yaw)
+	y_obj_rel_b = -dx*sin(yaw) + dy*cos(yaw)
+	z_obj_rel_b = dz
+	translation = np.array([-(y_obj_rel_b - obs_offset_y)/obs_factor_y, -(z_obj_rel_b - obs_offset_z)/obs_factor_z,
+		(x_obj_rel_b - obs_offset_x)/obs_factor_x])
+	if translation[2] < 0.3:
+		# behind or right at the camera
+		return None
+
+	q = pose.pose.pose.orientation
+	_,_,yaw_obj = quaternion_to_euler(q.w, q.x, q.y, q.z)
+	yaw_obj_rel = (yaw - yaw_obj + obs_offset_yaw)/obs_factor_yaw
+	pts = camera.project(model_points_yellow, np.array([0.0, yaw_obj_rel, 0.0]), translation)
+	if undistort_frame:
+		pts = camera.undistort_points(pts)
+	return pts
+
+def predict_roi(width, height):
+	# working level region around the gate, None to search the whole frame
+	if not track_roi or misses >= track_misses:
+		return None
+	if misses == 0 or pose_gate_filtered is None:
+		pts = last_corners[:,::-1]
+	else:
+		pts = project_gate(pose_gate_filtered)
+		if pts is None:
+			return None
+	pts = pts*scale
+	(x0, y0), (x1, y1) = pts.min(axis=0), pts.max(axis=0)
+	mx = roi_margin*(x1 - x0)
+	my = roi_margin*(y1 - y0)
+	x0 = int(max(0, x0 - mx))
+	y0 = int(max(0, y0 - my))
+	x1 = int(min(width, x1 + mx + 1))
+	y1 = int(min(height, y1 + my + 1))
+	if x1 - x0 < 16 or y1 - y0 < 16:
+		# gate (mostly) out of the frame
+		return None
+	return (x0, y0, x1, y1)
+
+def update_track(corners, detected):
+	global misses, last_corners
+	if detected:
+		misses = 0
+		last_corners = corners
+	else:
+		misses = misses + 1
 
+@profiler.timed('thresholding')
 def thresholding():
-	global raw_image, bin_image
-	global img, frame, img_orig, blank_image, img_lines_bin, img_corners
+	global raw_image
+	global img, frame, img_orig, roi
 	global height, width, scale
 
-	try:
-		img = bridge.imgmsg_to_cv2(raw_image, "bgr8")
-	except CvBridgeError as e:
-		print(e)
-
-	img = remove_distortion(img)
-
-	img_orig = img.copy()
-
-	#Resize image
-	scale = 1.0
-	width = int(img.shape[1] * scale)
-	height = int(img.shape[0] * scale)
-	dim = (width, height) #can also just specify desired dimensions
-	# img = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
-
-	blank_image = np.zeros(shape=[height, width, 3], dtype=np.uint8)
-
-	#Convert from BGR to HSV colorspace
-	frame = cv2.cvtColor(img, cv2.COLOR_BGR2HSV);
-
-	#Guassian blur
-	blur_params = (5,5)
-	frame = cv2.GaussianBlur(frame,blur_params,cv2.BORDER_DEFAULT)
-
-	#yellow
-	lower = (0, 80, 40) #lower threshhold values (H, S, V)
-	upper = (80, 255, 250) #upper threshhold values (H, S, V)
-	frame = cv2.inRange(frame, lower, upper)
-
-	# ##with single G
-	# #yellow
-	# P_thres = 2
-
-	# frameb = np.zeros(shape=[height,width, 1], dtype=np.uint8)
-	# mu = np.array([ 0.0889, 0.4376, 0.7321])
-	# sigma = np.array([[0.0010, 0.0012, 0.0047],[0.0012, 0.0040, 0.0060],[0.0047, 0.0060, 0.0252]])
-	# sigma_inv = np.linalg.inv(sigma)
-	# DEN = ((2*3.14)**(3/2))*sqrt(np.linalg.det(sigma))
-	# for i in range(height):
-	#     for j in range(width):
-	#         x = frame[i][j]/255.0
-	#         v = -0.5*np.dot((x-mu),np.matmul(sigma_inv,(x-mu)))
-	#         NUM = exp(v)
-	#         P = NUM/DEN
-	#         if (P>P_thres):
-	#             frameb[i][j] = 1
-	#         else:
-	#             frameb[i][j] = 0
-	# frame = frameb
+	#color image at the working level of the pyramid, read from the message without conversion for bgr8
+	scale = 0.5**pyramid_level
+	img = images.color(raw_image, pyramid_level)
+	width = img.shape[1]
+	height = img.shape[0]
+
+	# region around the tracked gate, the whole frame while searching
+	roi = predict_roi(width, height)
+
+	# only drawn on through a copy
+	img_orig = img
+	if undistort_frame:
+		img = remove_distortion(img, roi)
+		if roi is None:
+			img_orig = img
+	elif roi is not None:
+		img = img[roi[1]:roi[3],roi[0]:roi[2]]
+
+	#yellow, classified on BGR through the colour table and smoothed on the single channel mask
+	frame = gate_segmentation.segment(color_model, img, scale)
+
+	# gate_detect_cross takes this mask instead of segmenting the image again: the whole
+	# frame, empty outside the region around the tracked gate (the gate is inside it)
+	if pub_gate_mask.get_num_connections() > 0:
+		mask = frame
+		if roi is not None:
+			mask = np.zeros(img_orig.shape[:2], np.uint8)
+			mask[roi[1]:roi[3],roi[0]:roi[2]] = frame
+		mask = bridge.cv2_to_imgmsg(mask, "mono8")
+		mask.header = raw_image.header
+		pub_gate_mask.publish(mask)
+
+	if roi is not None:
+		width = roi[2] - roi[0]
+		height = roi[3] - roi[1]
 
 	#Erosion/dilation
-	kernel = np.ones((2,2), np.uint8) 
-	frame = cv2.erode(frame, kernel, iterations=1)
-	kernel = np.ones((4,4), np.uint8) 
-	frame = cv2.dilate(frame, kernel, iterations=1) 
+	frame = cv2.erode(frame, kernel(2), iterations=1)
+	frame = cv2.dilate(frame, kernel(4), iterations=1) 
 
-	bin_image = bridge.cv2_to_imgmsg(frame, "8UC1")
+	debug_bin.publish(frame)
 
+@profiler.timed('get_corners')
 def get_corners():
-	global contour_image, corner_image
-	global frame, img_centroids
-	global height, width
+	global frame
+	global height, width, scale
 
 	#Find contours and save only the biggest one
 	_,contours,_ = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -142,10 +224,8 @@ def get_corners():
 	    frame = cv2.drawContours(frame, [cntsSorted[-1]], 0, 255, thickness=cv2.FILLED)
 
 	#Erosion/dilation on biggest contour binary
-	kernel = np.ones((4,4), np.uint8) 
-	frame = cv2.erode(frame, kernel, iterations=1)
-	kernel = np.ones((4,4), np.uint8)
-	frame = cv2.dilate(frame, kernel, iterations=1)
+	frame = cv2.erode(frame, kernel(4), iterations=1)
+	frame = cv2.dilate(frame, kernel(4), iterations=1)
 
 	#Find edges of contour
 	_,contours,_ = cv2.findContours(frame, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
@@ -167,29 +247,27 @@ def get_corners():
 			# draw the contour
 			frame = cv2.drawContours(frame, [contours[0]], 0, 255, thickness=1)
 
-			if (cv2.arcLength(contours[0], True)>120):
+			if (cv2.arcLength(contours[0], True)>120*scale):
 				cluster_mean = contours[0]
 				for i in range(len(cluster_mean)):
-					e=5
+					e=5*scale
 					if (cluster_mean[i][0][0]>e and cluster_mean[i][0][0]<width-e and cluster_mean[i][0][1]>e and cluster_mean[i][0][1]<height-e ):
 						corners.append([cluster_mean[i][0][1], cluster_mean[i][0][0]])
 	
 	corners = np.asarray(corners)
+	if roi is not None and len(corners) > 0:
+		corners = corners + [roi[1], roi[0]]
 
-	#Overlay final corners on original image
-	img_centroids = img_orig.copy()
-	for i in range(len(corners)):
-		center = (corners[i][1],corners[i][0])
-		cv2.circle(img_centroids, center, 2, [0,255,0], 5)
-
-	contour_image = bridge.cv2_to_imgmsg(frame, "8UC1")
-	corner_image = bridge.cv2_to_imgmsg(img_centroids, "8UC3")
+	debug_contour.publish(frame)
+	debug_corner.publish(lambda: draw_roi(draw_corners(img_orig.copy(), corners), roi))
 
-	return corners
+	# (row, col) in full resolution pixels
+	return to_full(corners, pyramid_level)
 
+@profiler.timed('pose_solve')
 def pose_solve(cluster_mean):
 	global pose_rel, pub_pose_rel
-	global translation_pnp, rotation_pnp
+	global translation_pnp, rotation_pnp, pose_covariance
 	global camera_matrix, dist_coeffs, image_points, model_points_yellow
 	global scale
 	if len(cluster_mean)>3:
@@ -240,38 +318,33 @@ def pose_solve(cluster_mean):
 	    #                                (0,0,.43),
 	    #                        ])
 
-		# focal_length_x = 743.595409 #get from camera calibration
-		# focal_length_y = 750.175831 #get from camera calibration
-		
-		###### with larger FOV setting ############
-		focal_length_x = 353.939474 #get from camera calibration
-		focal_length_y = 353.169928 #get from camera calibration
-		
-		# focal_length_x = 256.089233 #get from camera calibration
-		# focal_length_y = 299.638275 #get from camera calibration
-		
-		size = frame.shape
-		center = (size[1]/2, size[0]/2)
-		# print(scale)
-		# center = (scale*357.244818, scale*192.270976)
-		# center = (scale*313.280662, scale*225.264003)
-		# center = (scale*309.118667, scale*218.854947)
-		
-		camera_matrix = np.array(
-								[[focal_length_x, 0, center[0]],
-								[0, focal_length_y, center[1]],
-								[0, 0, 1]], dtype = "double"
-								)
-		# dist_coeffs = np.array([-0.337798, 0.142319, 0.001475, 0.003604, 0.0]) #get from camera calibration
-		# dist_coeffs = np.array([-0.271345, 0.06, -0.000446, -0.000109, 0.0]) #get from camera calibration
-		dist_coeffs = np.zeros((4,1))
-
-		(success, rotation_pnp, translation_pnp) = cv2.solvePnP(model_points_yellow, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+		#full resolution calibration, the corners are still distorted unless the frame was remapped
+		camera_matrix = camera.camera_matrix
+		if undistort_frame:
+			dist_coeffs = np.zeros((4,1))
+		else:
+			dist_coeffs = camera.dist_coeffs
+
+		#planar solution, warm started from the last pose while the gate is tracked
+		guess = None
+		if rotation_pnp is not None and misses < track_misses:
+			guess = (rotation_pnp, translation_pnp)
+		rotation, translation, error = planar_pnp.solve(model_points_yellow, image_points, camera_matrix, dist_coeffs, guess, max_reproj_error)
 		#returns a rotation and translation matrix of the extrinsic matrix of the camera 
 		#i.e. rotation of the camera relative to fixed world origin (top left corner of window)
 
+		#reject bad fits and jumps (flips) away from the tracked pose
+		if error > max_reproj_error:
+			return False
+		if guess is not None and (np.linalg.norm(translation - translation_pnp) > max_jump or
+				planar_pnp.rotation_change(rotation_pnp, rotation) > max_jump_angle):
+			return False
+
 		# print(rotation_pnp)
-		if (abs(rotation_pnp[0])<0.4 and abs(rotation_pnp[2])<0.4):
+		if (abs(rotation[0])<0.4 and abs(rotation[2])<0.4):
+			rotation_pnp = rotation
+			translation_pnp = translation
+			pose_covariance = planar_pnp.covariance(model_points_yellow, image_points, rotation_pnp, translation_pnp, camera_matrix, dist_coeffs, pixel_sigma)
 			
 			rotation_pnp_pub = rotation_pnp.copy()
 			# if(rotation_pnp_pub[0]>0):
@@ -295,6 +368,7 @@ def pose_solve(cluster_mean):
 			pose_rel.pose.pose.orientation.x = rotation_pnp_q[1]
 			pose_rel.pose.pose.orientation.y = rotation_pnp_q[2]
 			pose_rel.pose.pose.orientation.z = rotation_pnp_q[3]
+			pose_rel.pose.covariance = list(pose_covariance.ravel())
 			pub_pose_rel.publish(pose_rel)
 
 			pose_cam2in()
@@ -307,7 +381,7 @@ def pose_solve(cluster_mean):
 def pose_cam2in():
 	global pose_rel, pose_gate_in, x, y, z, yaw
 	global pub_pose_gate_in
-	global translation_pnp, rotation_pnp
+	global translation_pnp, rotation_pnp, pose_covariance
 
 	# q0 = pose_rel.pose.pose.orientation.w
 	# q1 = pose_rel.pose.pose.orientation.x
@@ -356,6 +430,13 @@ def pose_cam2in():
 	pose_gate_in.pose.pose.orientation.y = 0.0
 	pose_gate_in.pose.pose.orientation.z = sin(0.5*yaw_obj)
 
+	# covariance of (x, y, z, yaw) through the linear camera to inertial transform, roll and pitch are not observed
+	G = np.zeros((6,6))
+	G[0:2,0:3] = np.dot([[cos(yaw), -sin(yaw)], [sin(yaw), cos(yaw)]], [[0.0, 0.0, obs_factor_x], [-obs_factor_y, 0.0, 0.0]])
+	G[2,1] = -obs_factor_z
+	G[5,4] = -obs_factor_yaw
+	pose_gate_in.pose.covariance = list(np.dot(np.dot(G, pose_covariance), G.T).ravel())
+
 	pub_pose_gate_in.publish(pose_gate_in)
 
 	# rospy.loginfo('x %f \t y %f \t z %f \t yaw %f', x_obj, y_obj, z_obj, yaw_obj)
@@ -402,35 +483,48 @@ def quaternion_to_euler(w, x, y, z):
     # return [yaw, pitch, roll]
     return [roll, pitch, yaw]
 
+def draw_corners(img_centroids, corners):
+	#Overlay final corners on original image
+	for i in range(len(corners)):
+		center = (int(corners[i][1]),int(corners[i][0]))
+		cv2.circle(img_centroids, center, 2, [0,255,0], 5)
+	return img_centroids
+
+def draw_roi(img_roi, roi):
+	if roi is not None:
+		cv2.rectangle(img_roi, (roi[0], roi[1]), (roi[2]-1, roi[3]-1), (255,0,0), 1)
+	return img_roi
+
 def pose_display(cluster_mean):
-	global img_orig, pose_rel, pose_image, img_centroids
+	global img_orig, pose_rel, scale
 	global camera_matrix, dist_coeffs, image_points, model_points_yellow
 	global translation_pnp, rotation_pnp
 		#re-project line onto each corner to see 3D orientation found by solvePnP
-	# img_centroids = img_orig.copy()
+	#drawn at the working level, the points are in full resolution pixels
+	img_centroids = draw_corners(img_orig.copy(), cluster_mean*scale)
 	if (len(cluster_mean)>3): 
 		# translation_pnp = np.array([pose_rel.pose.pose.position.x,pose_rel.pose.pose.position.y,pose_rel.pose.pose.position.z])
 		# rotation_pnp = np.array(quaternion_to_euler(pose_rel.pose.pose.orientation.w, pose_rel.pose.pose.orientation.x, pose_rel.pose.pose.orientation.y, pose_rel.pose.pose.orientation.z))
 		#project a line of length l_test on each corner corner NEED TO ORDER THE CLUSTER_MEAN ARRAY
 		l_test = .5
 		(gate_origin, jacobian) = cv2.projectPoints(np.array([(0.0, 0.0, l_test)]), rotation_pnp, translation_pnp, camera_matrix, dist_coeffs)
-		p1 = ( int(image_points[0][0]), int(image_points[0][1]))
-		p2 = ( int(gate_origin[0][0][0]), int(gate_origin[0][0][1]))
+		p1 = ( int(scale*image_points[0][0]), int(scale*image_points[0][1]))
+		p2 = ( int(scale*gate_origin[0][0][0]), int(scale*gate_origin[0][0][1]))
 		img_centroids = cv2.line(img_centroids, p1, p2, (0,255,0), 2)
 		
 		(gate_origin, jacobian) = cv2.projectPoints(np.array([(model_points_yellow[1][0],model_points_yellow[1][1], l_test)]), rotation_pnp, translation_pnp, camera_matrix, dist_coeffs)
-		p1 = ( int(image_points[1][0]), int(image_points[1][1]))
-		p2 = ( int(gate_origin[0][0][0]), int(gate_origin[0][0][1]))
+		p1 = ( int(scale*image_points[1][0]), int(scale*image_points[1][1]))
+		p2 = ( int(scale*gate_origin[0][0][0]), int(scale*gate_origin[0][0][1]))
 		img_centroids = cv2.line(img_centroids, p1, p2, (0,255,0), 2)
 		
 		(gate_origin, jacobian) = cv2.projectPoints(np.array([(model_points_yellow[2][0],model_points_yellow[2][1], l_test)]), rotation_pnp, translation_pnp, camera_matrix, dist_coeffs)
-		p1 = ( int(image_points[2][0]), int(image_points[2][1]))
-		p2 = ( int(gate_origin[0][0][0]), int(gate_origin[0][0][1]))
+		p1 = ( int(scale*image_points[2][0]), int(scale*image_points[2][1]))
+		p2 = ( int(scale*gate_origin[0][0][0]), int(scale*gate_origin[0][0][1]))
 		img_centroids = cv2.line(img_centroids, p1, p2, (0,255,0), 2)
 	
 		(gate_origin, jacobian) = cv2.projectPoints(np.array([(model_points_yellow[3][0],model_points_yellow[3][1], l_test)]), rotation_pnp, translation_pnp, camera_matrix, dist_coeffs)
-		p1 = ( int(image_points[3][0]), int(image_points[3][1]))
-		p2 = ( int(gate_origin[0][0][0]), int(gate_origin[0][0][1]))
+		p1 = ( int(scale*image_points[3][0]), int(scale*image_points[3][1]))
+		p2 = ( int(scale*gate_origin[0][0][0]), int(scale*gate_origin[0][0][1]))
 		img_centroids = cv2.line(img_centroids, p1, p2, (0,255,0), 2)
 		
 		font                   = cv2.FONT_HERSHEY_SIMPLEX
@@ -463,40 +557,62 @@ def pose_display(cluster_mean):
 		    fontColor,
 		    lineType)
 
-	pose_image = bridge.cv2_to_imgmsg(img_centroids, "8UC3")
+	return img_centroids
 
 def callback(image):
 	global raw_image
 	raw_image = image
 
+def gate_filtered(data):
+	global pose_gate_filtered
+	pose_gate_filtered = data
+
 def get_master_mission(data):
 	global master_mission_no
 	master_mission_no = data.data
 
 pub_pose_gate_in = rospy.Publisher('/pose_gate_in', Odometry, queue_size=10)
 def main():
-	global raw_image, bin_image, debug_image, pose_rel, pub_pose_rel
+	global raw_image, debug_image, pose_rel, pub_pose_rel, pub_gate_mask
+	global pyramid_level, camera, undistort_frame
+	global track_roi, track_misses, misses, roi_margin, color_model
+	global max_reproj_error, max_jump, max_jump_angle, pixel_sigma
 	rospy.init_node('window_detect', anonymous=True)
+	pyramid_level = rospy.get_param('~pyramid_level', pyramid_level)
+	camera = CameraModel.from_yaml(rospy.get_param('~calibration', default_calibration))
+	undistort_frame = rospy.get_param('~undistort_frame', undistort_frame)
+	color_model = gate_segmentation.color_model(rospy.get_param('~color_model', 'box'), rospy.get_param('~color_lut', ''))
+	track_roi = rospy.get_param('~track_roi', track_roi)
+	track_misses = rospy.get_param('~track_misses', track_misses)
+	misses = track_misses
+	roi_margin = rospy.get_param('~roi_margin', roi_margin)
+	max_reproj_error = rospy.get_param('~max_reproj_error', max_reproj_error)
+	max_jump = rospy.get_param('~max_jump', max_jump)
+	max_jump_angle = rospy.get_param('~max_jump_angle', max_jump_angle)
+	pixel_sigma = rospy.get_param('~pixel_sigma', pixel_sigma)
 
 	pub_pose_rel = rospy.Publisher('/pose_rel_win', Odometry, queue_size=10)
-	pub_bin_image = rospy.Publisher('/bin_image', Image, queue_size=10)
-	pub_contour_image = rospy.Publisher('/contour_image', Image, queue_size=10)
-	pub_corner_image = rospy.Publisher('/corner_image', Image, queue_size=10)
-	# pub_pose_image = rospy.Publisher('/pose_image', Image, queue_size=10)
-	pub_pose_image = rospy.Publisher('/pose_image_txt', Image, queue_size=10)
+	pub_gate_mask = rospy.Publisher(gate_segmentation.mask_topic, Image, queue_size=1)
 	pub_debug_image = rospy.Publisher('/debug_image', Image, queue_size=10)
+	set_rate([debug_bin, debug_contour, debug_corner, debug_pose], rospy.get_param('~debug_rate', 5.0))
 
 	# rospy.Subscriber('/cv_camera/image_raw', Image, callback)
 	rospy.Subscriber('/image_raw', Image, callback)
 	# rospy.Subscriber('/image_raw_throttle', Image, callback)
 
 	rospy.Subscriber('/pose_in', Odometry, quad_pose)
+	rospy.Subscriber('/pose_gate_in_filtered', Odometry, gate_filtered)
 	rospy.Subscriber('/master_mission_no', Int32, get_master_mission)
 
+	if rospy.get_param('~profile', False):
+		profiler.start(rospy.get_param('~profile_period', 5.0))
+
 	rate = rospy.Rate(10)
 	while not rospy.is_shutdown():
 
-		if (master_mission_no == 1):
+		# nothing to do before the first image
+		if (master_mission_no == 1 and raw_image.data):
+			profiler.frame(raw_image.header)
 			# try:
 			# 	thresholding()
 			# 	corners = get_corners()
@@ -509,13 +625,10 @@ def main():
 			thresholding()
 			corners = get_corners()
 			flag_publish = pose_solve(corners)
+			update_track(corners, flag_publish)
 			if (flag_publish):
-				pose_display(corners)
+				debug_pose.publish(lambda: pose_display(corners))
 
-			pub_bin_image.publish(bin_image)
-			pub_contour_image.publish(contour_image)
-			pub_corner_image.publish(corner_image)
-			pub_pose_image.publish(pose_image)
 			pub_debug_image.publish(debug_image)
 		rate.sleep()
 
@@ -10,6 +10,9 @@ from nav_msgs.msg import Odometry
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 from decimal import Decimal
+from autobebop.camera_model import CameraModel, default_calibration
+from autobebop import gate_segmentation
+from autobebop.image_cache import ImageCache
 
 master_mission_no = 0
 
@@ -26,72 +29,63 @@ img = np.zeros((480,640,3), np.uint8)
 raw_image = Image()
 bin_image_cross = Image()
 
-bridge = CvBridge()
+# colour mask of gate_detect (~mask_topic, e.g. /gate_mask) used instead of segmenting /image_raw here
+mask_topic = ''
 
-pose_gate_in = Odometry()
+bridge = CvBridge()
 
-def remove_distortion(img):
-	width  = img.shape[1]
-	height = img.shape[0]
+# gray and color images of the last few messages
+images = ImageCache()
 
-	dist_coeffs = np.array([-0.271345, 0.06, -0.000446, -0.000109, 0.0]) #get from camera calibration
+pose_gate_in = Odometry()
 
-	# assume unit matrix for camera
-	cam = np.eye(3,dtype=np.float32)
+# level of the image pyramid the gate is segmented at (0 full resolution, 1 half, ...), ~pyramid_level
+pyramid_level = 0
+scale = 1.0
 
-	cam[0,2] = width/2.0  # define center x
-	cam[1,2] = height/2.0 # define center y
+def kernel(size):
+	# size x size structuring element at full resolution, shrunk to the working level
+	size = max(1, int(round(size*scale)))
+	return np.ones((size,size), np.uint8)
 
-	focal_length_x = 353.939474 #get from camera calibration
-	focal_length_y = 353.169928 #get from camera calibration
-	cam[0,0] = focal_length_x        # define focal length x
-	cam[1,1] = focal_length_y        # define focal length y
+# calibrated camera, ~calibration (camera_info YAML)
+camera = CameraModel.from_yaml()
 
-	img = cv2.undistort(img,cam,dist_coeffs)
+# yellow of the gate (~color_model 'box' / 'gaussian', or a table trained offline, ~color_lut)
+color_model = gate_segmentation.color_model()
 
-	return img
+def remove_distortion(img):
+	# img at the working level, through the precomputed maps of the level
+	return camera.remap(img, pyramid_level)
 
 def thresholding():
 	global raw_image, bin_image_cross, frame
-	global img, frame, img_orig, blank_image, img_lines_bin, img_corners
+	global img, frame, img_orig
 	global height, width, scale
 
-	try:
-		img = bridge.imgmsg_to_cv2(raw_image, "bgr8")
-	except CvBridgeError as e:
-		print(e)
-
-	#img = remove_distortion(img)
-
-	img_orig = img.copy()
-
-	#Resize image
-	scale = 1.0
-	width = int(img.shape[1] * scale)
-	height = int(img.shape[0] * scale)
-	dim = (width, height) #can also just specify desired dimensions
-	# img = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
-
-	blank_image = np.zeros(shape=[height, width, 3], dtype=np.uint8)
-
-	#Convert from BGR to HSV colorspace
-	frame = cv2.cvtColor(img, cv2.COLOR_BGR2HSV);
+	if mask_topic:
+		#yellow mask of gate_detect, read from the message without a copy, at the level it was segmented at
+		frame = images.gray(raw_image)
+		scale = frame.shape[1]/float(camera.width)
+		width = frame.shape[1]
+		height = frame.shape[0]
+	else:
+		#color image at the working level of the pyramid, read from the message without conversion for bgr8
+		scale = 0.5**pyramid_level
+		img = images.color(raw_image, pyramid_level)
+		width = img.shape[1]
+		height = img.shape[0]
 
-	#Guassian blur
-	blur_params = (5,5)
-	frame = cv2.GaussianBlur(frame,blur_params,cv2.BORDER_DEFAULT)
+		#img = remove_distortion(img)
 
-	#yellow
-	lower = (0, 80, 40) #lower threshhold values (H, S, V)
-	upper = (80, 255, 250) #upper threshhold values (H, S, V)
-	frame = cv2.inRange(frame, lower, upper)
+		img_orig = img
 
+		#yellow, classified on BGR through the colour table and smoothed on the single channel mask
+		frame = gate_segmentation.segment(color_model, img, scale)
 
 	#Erosion/dilation
-	kernel = np.ones((6,6), np.uint8) 
-	frame = cv2.erode(frame, kernel, iterations=1)
-	kernel = np.ones((2,2), np.uint8) 
-	frame = cv2.dilate(frame, kernel, iterations=1) 
+	frame = cv2.erode(frame, kernel(6), iterations=1)
+	frame = cv2.dilate(frame, kernel(2), iterations=1) 
 
 	bin_image_cross = bridge.cv2_to_imgmsg(frame, "8UC1")
 
@@ -144,14 +138,21 @@ def get_master_mission(data):
 
 
 def main():
-	global raw_image, bin_image_cross
+	global raw_image, bin_image_cross, pyramid_level, camera, color_model, mask_topic
 	rospy.init_node('window_detect_cross', anonymous=True)
+	pyramid_level = rospy.get_param('~pyramid_level', pyramid_level)
+	camera = CameraModel.from_yaml(rospy.get_param('~calibration', default_calibration))
+	color_model = gate_segmentation.color_model(rospy.get_param('~color_model', 'box'), rospy.get_param('~color_lut', ''))
+	mask_topic = rospy.get_param('~mask_topic', mask_topic)
 
 	pub_bin_image_cross = rospy.Publisher('/bin_image_cross', Image, queue_size=10)
 	pub_cross_bias = rospy.Publisher('/cross_bias', Float64, queue_size=1, latch=True)
 
 	# rospy.Subscriber('/cv_camera/image_raw', Image, callback)
-	rospy.Subscriber('/image_raw', Image, callback)
+	if mask_topic:
+		rospy.Subscriber(mask_topic, Image, callback)
+	else:
+		rospy.Subscriber('/image_raw', Image, callback)
 	# rospy.Subscriber('/image_raw_throttle', Image, callback)
 
 	rospy.Subscriber('/master_mission_no', Int32, get_master_mission)
@@ -160,7 +161,8 @@ def main():
 	while not rospy.is_shutdown():
 
 		#if (master_mission_no == 1): #change when done troubleshooting
-		if (master_mission_no == 1):
+		# nothing to do before the first image
+		if (master_mission_no == 1 and raw_image.data):
 			# try:
 			# 	thresholding()
 			# 	corners = get_corners()
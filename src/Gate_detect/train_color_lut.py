@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+Offline training of the gate colour table from labelled frames
+
+The folder holds the frames (any image cv2 reads) and next to every frame
+<name>_mask.png, nonzero on the gate pixels. Frames without a mask are
+skipped. The table (npz) is used by gate_detect / gate_detect_cross through
+~color_lut.
+
+	python train_color_lut.py /path/to/frames --out ../../cfg/gate_color_lut.npz
+"""
+
+import argparse, glob, os
+import cv2
+import numpy as np
+from autobebop.color_lut import ColorLUT
+
+def main():
+	parser = argparse.ArgumentParser(description='Trains a colour lookup table from frames and gate masks')
+	parser.add_argument('frames')
+	parser.add_argument('--bits', type=int, default=5, help='bits per BGR channel of the table')
+	parser.add_argument('--prior', type=float, default=1.0, help='negative pixels assumed in every bin')
+	parser.add_argument('--out', default='gate_color_lut.npz')
+	args = parser.parse_args()
+
+	images = []
+	masks = []
+	for path in sorted(glob.glob(os.path.join(args.frames, '*'))):
+		name, ext = os.path.splitext(path)
+		mask_path = name + '_mask.png'
+		if name.endswith('_mask') or not os.path.exists(mask_path):
+			continue
+		image = cv2.imread(path, cv2.IMREAD_COLOR)
+		mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+		if image is None or mask is None or mask.shape != image.shape[:2]:
+			print('skipping ' + path)
+			continue
+		images.append(image)
+		masks.append(mask)
+
+	if not images:
+		print('no labelled frame in ' + args.frames)
+		return
+
+	lut = ColorLUT.train(images, masks, bits=args.bits, prior=args.prior)
+	lut.save(args.out)
+
+	# training set accuracy of the table
+	correct = 0
+	total = 0
+	for image, mask in zip(images, masks):
+		correct = correct + np.count_nonzero((lut.segment(image) > 0) == (mask > 0))
+		total = total + mask.size
+	print('%d frames, %d of %d bins positive, %.2f%% of the pixels classified right, saved to %s' % (len(images),
+		np.count_nonzero(lut.table >= 128), len(lut.table), 100.0*correct/total, args.out))
+
+if __name__ == '__main__':
+	main()
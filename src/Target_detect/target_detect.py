@@ -8,9 +8,18 @@ from std_msgs.msg import String, Float64, Empty, Int32
 from nav_msgs.msg import Odometry
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
+from autobebop.debug_images import DebugImage, set_rate
+from autobebop.image_cache import ImageCache, to_full
+from autobebop.profiling import Profiler
 
 bridge = CvBridge()
 
+# gray and color images of the last few messages
+images = ImageCache()
+
+# stage latencies, published on /diagnostics with ~profile
+profiler = Profiler('target_detect')
+
 master_mission_no = 0
 
 # observation factors for camera (tuning param), should not be necessary if camera is properly calibrated and pnp is working
@@ -25,17 +34,23 @@ obs_offset_z = 0.0
 # current state of quad
 x = y = z = vx = vy = vz = roll = pitch = yaw = 0.0
 
-#Original image in opencv
-img = np.zeros((480,640,3), np.uint8)
+#image message of the last thresholded frame
+img_msg = Image()
 
 #ros Images
 raw_image = Image()
-bin_image = Image()
-circles_image = Image()
-circle_avg_image = Image()
 debug_image = Image()
 
-#circle parameters
+# thresholded image and detected circles, only drawn while they have subscribers
+debug_bin = DebugImage('/bin_image', "8UC1")
+debug_circles = DebugImage('/circles_image', "8UC3")
+debug_circle_avg = DebugImage('/circle_avg_image', "8UC3")
+
+# level of the image pyramid the target is detected at (0 full resolution, 1 half, ...), ~pyramid_level
+pyramid_level = 0
+scale = 1
+
+#circle parameters, in full resolution pixels
 a= 0.0
 cx = 0.0
 cy = 0.0
@@ -44,126 +59,94 @@ cy = 0.0
 pose_rel = Odometry()
 pose_target_in = Odometry()
 
+@profiler.timed('thresholding')
 def thresholding():
-	global raw_image, bin_image
-	global img
+	global raw_image
+	global img_msg
 	global height, width, scale
 
-	try:
-		img = bridge.imgmsg_to_cv2(raw_image, "bgr8")
-	except CvBridgeError as e:
-		print(e)
-
-	img_height = len(img)
-	img_width = len(img[0])
-
-
-	#Resize image
-	scale = 1
-	width = int(img.shape[1] * scale)
-	height = int(img.shape[0] * scale)
-	dim = (width, height) #can also just specify desired dimensions
-	# img = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
+	#gray image at the working level of the pyramid, read from the message without conversion for mono8
+	img_msg = raw_image
+	scale = 0.5**pyramid_level
+	frame = images.gray(img_msg, pyramid_level)
+	width = frame.shape[1]
+	height = frame.shape[0]
 	# print('Image Height:')
 	# print(height)
 	# print('Image Width:')
 	# print(width)
 
 
-	#Convert from BGR to gray colorspace
-	frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY);
-
-	gray_img = frame.copy()
-
 	lower = (235) #lower threshhold values (H, S, V)
 	upper = (255) #upper threshhold values (H, S, V)
 	frame = cv2.inRange(frame, lower, upper)
 
-	#Erosion/ Dilation
+	#Erosion/ Dilation, the iterations shrink with the working level
 	kernel = np.ones((2,2), np.uint8) 
-	frame = cv2.erode(frame, kernel, iterations=3)
-	kernel = np.ones((2,2), np.uint8) 
-	frame = cv2.dilate(frame, kernel, iterations=3)
+	iterations = max(1, int(round(3*scale)))
+	frame = cv2.erode(frame, kernel, iterations=iterations)
+	frame = cv2.dilate(frame, kernel, iterations=iterations)
 
-	bin_image = bridge.cv2_to_imgmsg(frame, "8UC1")
+	debug_bin.publish(frame)
 
 	return frame
 
+def draw_circles(img1, circles):
+	for i in circles[0,:]:
+		# draw the outer circle
+		cv2.circle(img1,(i[0],i[1]),i[2],(0,255,0),2)
+		# draw the center of the circle
+		cv2.circle(img1,(i[0],i[1]),2,(0,0,255),3)
+	return img1
+
+def draw_circle_avg(img2, a, cx, cy):
+	cv2.circle(img2,(cx.astype(int),cy.astype(int)),a.astype(int),(0,255,0),5)
+	cv2.circle(img2,(cx.astype(int),cy.astype(int)),2,(0,0,255),5)
+	return img2
+
+@profiler.timed('get_circle')
 def get_circle(frame):
 	global a, cx, cy
-	global img, circles_image, circle_avg_image
+	global img_msg, scale
 
 	circles = cv2.HoughCircles(frame,cv2.HOUGH_GRADIENT,1,1,
-                            param1=100,param2=50,minRadius=0,maxRadius=0)
+                            param1=100,param2=50*scale,minRadius=0,maxRadius=0)
 
-	a = []
-	cx = []
-	cy = []
-	img1 = img.copy()
 	if circles is not None:
 		# print(len(circles))
 		circles = np.uint16(np.around(circles))
-		for i in circles[0,:]:
-			# draw the outer circle
-			cv2.circle(img1,(i[0],i[1]),i[2],(0,255,0),2)
-			# draw the center of the circle
-			cv2.circle(img1,(i[0],i[1]),2,(0,0,255),3)
-
-			a.append(i[2])
-			cx.append(i[0])
-			cy.append(i[1])
-
 
-		a = np.average(a)
-		cx = np.average(cx)
-		cy = np.average(cy)
+		a = np.average(circles[0,:,2])
+		cx = np.average(circles[0,:,0])
+		cy = np.average(circles[0,:,1])
 
-		img2 = img.copy()
-		cv2.circle(img2,(cx.astype(int),cy.astype(int)),a.astype(int),(0,255,0),5)
-		cv2.circle(img2,(cx.astype(int),cy.astype(int)),2,(0,0,255),5)
-
-		circles_image = bridge.cv2_to_imgmsg(img1, "8UC3")
-		circle_avg_image = bridge.cv2_to_imgmsg(img2, "8UC3")
+		debug_circles.publish(lambda: draw_circles(images.color(img_msg, pyramid_level).copy(), circles))
+		debug_circle_avg.publish(lambda: draw_circle_avg(images.color(img_msg, pyramid_level).copy(), a, cx, cy))
+		a, cx, cy = to_full((a, cx, cy), pyramid_level)
 
 		return True
 	else:
 		return False
 
+@profiler.timed('get_square')
 def get_square(frame):
 	global a, cx, cy
-	global img, circles_image, circle_avg_image
+	global img_msg, scale
 
 	circles = cv2.HoughCircles(frame,cv2.HOUGH_GRADIENT,1,1,
-                            param1=100,param2=42,minRadius=0,maxRadius=0)
+                            param1=100,param2=42*scale,minRadius=0,maxRadius=0)
 
-	a = []
-	cx = []
-	cy = []
-	img1 = img.copy()
 	if circles is not None:
 		# print(len(circles))
 		circles = np.uint16(np.around(circles))
-		for i in circles[0,:]:
-			# draw the outer circle
-			cv2.circle(img1,(i[0],i[1]),i[2],(0,255,0),2)
-			# draw the center of the circle
-			cv2.circle(img1,(i[0],i[1]),2,(0,0,255),3)
-
-			a.append(i[2])
-			cx.append(i[0])
-			cy.append(i[1])
-
 
-		a = np.average(a)
-		cx = np.average(cx)
-		cy = np.average(cy)
+		a = np.average(circles[0,:,2])
+		cx = np.average(circles[0,:,0])
+		cy = np.average(circles[0,:,1])
 
-		img2 = img.copy()
-		cv2.circle(img2,(cx.astype(int),cy.astype(int)),a.astype(int),(0,255,0),5)
-		cv2.circle(img2,(cx.astype(int),cy.astype(int)),2,(0,0,255),5)
-
-		circles_image = bridge.cv2_to_imgmsg(img1, "8UC3")
-		circle_avg_image = bridge.cv2_to_imgmsg(img2, "8UC3")
+		debug_circles.publish(lambda: draw_circles(images.color(img_msg, pyramid_level).copy(), circles))
+		debug_circle_avg.publish(lambda: draw_circle_avg(images.color(img_msg, pyramid_level).copy(), a, cx, cy))
+		a, cx, cy = to_full((a, cx, cy), pyramid_level)
 
 		return True
 	else:
@@ -178,11 +161,11 @@ def get_pose(R):
 	u2 = cx+a
 	v2 = cy
 
-	#Camera Parameters
+	#Camera Parameters, full resolution
 	fx = 300
 	fy = 300
-	cam_cx = width/2.0
-	cam_cy = height/2.0
+	cam_cx = width/scale/2.0
+	cam_cy = height/scale/2.0
 
 	z = R*fx*fy*(1.0/(fx**2*v1**2 - 2.0*fx**2*v1*v2 + fx**2*v2**2 + fy**2*u1**2 - 2*fy**2*u1*u2 + fy**2*u2**2))**(0.5)
 
@@ -294,23 +277,27 @@ def get_master_mission(data):
 
 pub_pose_target_in = rospy.Publisher('/pose_target_in', Odometry, queue_size=10)
 def main():
-	global raw_image, bin_image, debug_image, pub_pose_rel, circles_image, circle_avg_image
+	global raw_image, debug_image, pub_pose_rel
+	global pyramid_level
 	rospy.init_node('target_detect', anonymous=True)
+	pyramid_level = rospy.get_param('~pyramid_level', pyramid_level)
 
 	pub_pose_rel = rospy.Publisher('/pose_rel_target', Odometry, queue_size=10)
-	pub_bin_image = rospy.Publisher('/bin_image', Image, queue_size=10)
 	pub_debug_image = rospy.Publisher('/debug_image', Image, queue_size=10)
-	pub_circles_image = rospy.Publisher('/circles_image', Image, queue_size=10)
-	pub_circle_avg_image = rospy.Publisher('/circle_avg_image', Image, queue_size=10)
+	set_rate([debug_bin, debug_circles, debug_circle_avg], rospy.get_param('~debug_rate', 5.0))
 
 	rospy.Subscriber('/duo3d/left/image_rect', Image, callback) #should be faster than 20Hz or the rate of publishing below, else EKF might get fucked up
 	rospy.Subscriber('/pose_in', Odometry, quad_pose)
 	rospy.Subscriber('/master_mission_no', Int32, get_master_mission)
 
+	if rospy.get_param('~profile', False):
+		profiler.start(rospy.get_param('~profile_period', 5.0))
+
 	rate = rospy.Rate(10)
 	while not rospy.is_shutdown():
 
 		if (master_mission_no==3 or master_mission_no==5):
+			profiler.frame(raw_image.header)
 
 			try:
 				frame = thresholding()
@@ -337,9 +324,6 @@ def main():
 			# if (circle_detected):
 			# 	get_pose()
 
-			pub_bin_image.publish(bin_image)
-			pub_circles_image.publish(circles_image)
-			pub_circle_avg_image.publish(circle_avg_image)
 			pub_debug_image.publish(debug_image)
 
 		rate.sleep()
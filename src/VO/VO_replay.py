@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""
+Offline replay of a stereo dataset through one of the VO nodes, without a
+ROS master or camera
+
+The dataset folder holds the left and right images and either
+  frames.csv   stamp,left,right (image paths relative to the folder)
+  odom.csv     stamp,x,y,z,qx,qy,qz,qw (optional)
+or
+  dataset.npz  stamp, left, right, and optionally odom_stamp, odom (Mx7)
+
+Every frame goes through the pose_estimation() of the node as fast as
+possible. The odom messages up to every frame are given to the node's
+bebop/odom callback like live, so the VO starts at the first odom pose. At
+the end frames/sec, per-stage latency percentiles and the trajectory error
+against the odom track are printed.
+
+	python VO_replay.py /path/to/dataset --node VO_3_img_plane_fit --param temporal_mode=klt
+"""
+
+import os
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import argparse, ast, csv, sys, time
+import cv2
+import numpy as np
+import rospy
+from nav_msgs.msg import Odometry
+from scipy.spatial.transform import Rotation as R, Slerp
+
+# module level callables of the VO nodes timed as stages
+stage_names = ['prepare_frames', 'extract_left', 'extract_right', 'match_stereo', 'match_temporal',
+	'three_view_correspondences', 'motion_field', 'solve_irls', 'ransac_motion', 'ransac_plane',
+	'integrate_attitude', 'describe_tracks', 'keyframe_estimation']
+
+def load_dataset(path):
+	# [stamps, left paths, right paths, odom stamps, odom (Mx7)], odom is None without odom
+	npz = os.path.join(path, 'dataset.npz')
+	if os.path.exists(npz):
+		data = np.load(npz)
+		odom_stamp = data['odom_stamp'] if 'odom_stamp' in data else None
+		odom = data['odom'] if 'odom' in data else None
+		left = [os.path.join(path, str(p)) for p in data['left']]
+		right = [os.path.join(path, str(p)) for p in data['right']]
+		return [np.asarray(data['stamp'], dtype=np.float64), left, right, odom_stamp, odom]
+
+	stamps = []
+	left = []
+	right = []
+	with open(os.path.join(path, 'frames.csv')) as f:
+		for row in csv.DictReader(f):
+			stamps.append(float(row['stamp']))
+			left.append(os.path.join(path, row['left']))
+			right.append(os.path.join(path, row['right']))
+
+	odom_stamp = None
+	odom = None
+	odom_csv = os.path.join(path, 'odom.csv')
+	if os.path.exists(odom_csv):
+		rows = []
+		with open(odom_csv) as f:
+			for row in csv.DictReader(f):
+				rows.append([float(row[k]) for k in ('stamp', 'x', 'y', 'z', 'qx', 'qy', 'qz', 'qw')])
+		rows = np.array(rows)
+		odom_stamp = rows[:,0]
+		odom = rows[:,1:]
+	return [np.array(stamps), left, right, odom_stamp, odom]
+
+def odom_message(t, odom):
+	msg = Odometry()
+	msg.header.stamp = rospy.Time.from_sec(t)
+	msg.header.frame_id = "odom"
+	msg.pose.pose.position.x = odom[0]
+	msg.pose.pose.position.y = odom[1]
+	msg.pose.pose.position.z = odom[2]
+	msg.pose.pose.orientation.x = odom[3]
+	msg.pose.pose.orientation.y = odom[4]
+	msg.pose.pose.orientation.z = odom[5]
+	msg.pose.pose.orientation.w = odom[6]
+	return msg
+
+def interpolate_odom(odom_stamp, odom, t):
+	# odom pose (position, quaternion) at the stamps t, clamped to the track
+	t = np.clip(t, odom_stamp[0], odom_stamp[-1])
+	pos = np.column_stack([np.interp(t, odom_stamp, odom[:,k]) for k in range(3)])
+	quat = Slerp(odom_stamp, R.from_quat(odom[:,3:]))(t).as_quat()
+	return np.column_stack((pos, quat))
+
+class StageTimer(object):
+	"""
+	Wraps a callable and records its wall time per call
+	"""
+
+	def __init__(self, name, fn, log):
+		self.name = name
+		self.fn = fn
+		self.log = log
+
+	def __call__(self, *args, **kwargs):
+		t = time.time()
+		try:
+			return self.fn(*args, **kwargs)
+		finally:
+			self.log.setdefault(self.name, []).append(time.time() - t)
+
+def instrument(node, log):
+	for name in stage_names:
+		if callable(getattr(node, name, None)):
+			setattr(node, name, StageTimer(name, getattr(node, name), log))
+	for name in ('orb', 'orb_right'):
+		detector = getattr(node, name, None)
+		if detector is not None:
+			detector.detectAndCompute = StageTimer('detectAndCompute', detector.detectAndCompute, log)
+	for name, method in (('tracker', 'track'), ('dense', 'compute'), ('keyframes', 'track')):
+		obj = getattr(node, name, None)
+		if obj is not None:
+			setattr(obj, method, StageTimer(name + '.' + method, getattr(obj, method), log))
+
+def parse_params(items):
+	params = {}
+	for item in items:
+		name, value = item.split('=', 1)
+		try:
+			value = ast.literal_eval(value)
+		except (ValueError, SyntaxError):
+			pass
+		params[name.lstrip('~')] = value
+	return params
+
+def percentiles(values):
+	values = np.asarray(values)*1000.0
+	return [len(values), np.mean(values), np.percentile(values, 50), np.percentile(values, 95), np.percentile(values, 99)]
+
+def main():
+	parser = argparse.ArgumentParser(description='Replays a stereo dataset through a VO node and benchmarks it')
+	parser.add_argument('dataset')
+	parser.add_argument('--node', default='VO_3_img_plane_fit', help='VO module in src/VO')
+	parser.add_argument('--param', action='append', default=[], help='node param name=value, may be repeated')
+	parser.add_argument('--max-frames', type=int, default=0)
+	parser.add_argument('--encoding', default='mono8', choices=['mono8', 'bgr8'], help='encoding of the replayed image messages (the DUO3D publishes mono8)')
+	parser.add_argument('--out', default='', help='npz file for the trajectories and stage times')
+	args = parser.parse_args()
+
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	node = __import__(args.node)
+
+	params = parse_params(args.param)
+	if hasattr(node, 'load_params'):
+		node.load_params(lambda name, default: params.get(name.lstrip('~'), default))
+	else:
+		for name, value in params.items():
+			setattr(node, name, value)
+
+	log = {}
+	instrument(node, log)
+
+	stamps, left, right, odom_stamp, odom = load_dataset(args.dataset)
+	if args.max_frames > 0:
+		stamps = stamps[:args.max_frames]
+	if odom is None:
+		node.flag_initialize = False
+
+	bridge = node.bridge
+	flag = cv2.IMREAD_GRAYSCALE if args.encoding == 'mono8' else cv2.IMREAD_COLOR
+	prev_msg = None
+	next_odom = 0
+	vo = []
+	t_load = []
+	t_frame = []
+	for i, t in enumerate(stamps):
+		tic = time.time()
+		img_L = cv2.imread(left[i], flag)
+		img_R = cv2.imread(right[i], flag)
+		left_msg = bridge.cv2_to_imgmsg(img_L, args.encoding)
+		right_msg = bridge.cv2_to_imgmsg(img_R, args.encoding)
+		left_msg.header.stamp = rospy.Time.from_sec(t)
+		left_msg.header.seq = i
+		right_msg.header = left_msg.header
+		t_load.append(time.time() - tic)
+
+		# odom received up to this frame
+		while odom is not None and next_odom < len(odom_stamp) and odom_stamp[next_odom] <= t:
+			node.get_first_odom_val(odom_message(odom_stamp[next_odom], odom[next_odom]))
+			next_odom = next_odom + 1
+
+		if prev_msg is None or node.flag_initialize:
+			# like the main loop before the first odom
+			node.t_X_old = t
+			prev_msg = left_msg
+			continue
+
+		node.left_image = left_msg
+		node.right_image = right_msg
+		node.left_prev_image = prev_msg
+		node.dt_L = t - prev_msg.header.stamp.to_sec()
+		pair = [left_msg, right_msg, prev_msg, node.dt_L]
+		prev_msg = left_msg
+
+		tic = time.time()
+		if hasattr(node, 'prepare_frames'):
+			frames = node.prepare_frames(pair)
+			if frames is not None:
+				node.pose_estimation(frames, node.extract_left(frames), node.extract_right(frames))
+		else:
+			node.pose_estimation()
+		t_frame.append(time.time() - tic)
+
+		if node.pose_in.header.stamp == left_msg.header.stamp:
+			vo.append([t] + list(node.pos) + list(node.quat))
+
+	if not t_frame:
+		print('no frame was processed')
+		return
+
+	print('%s: %d frames, %.1f frames/sec (%.1f with image loading)' % (args.node, len(t_frame),
+		len(t_frame)/np.sum(t_frame), len(t_frame)/(np.sum(t_frame) + np.sum(t_load))))
+	print('%-28s %6s %8s %8s %8s %8s' % ('stage [ms]', 'calls', 'mean', 'p50', 'p95', 'p99'))
+	print('%-28s %6d %8.2f %8.2f %8.2f %8.2f' % tuple(['frame'] + percentiles(t_frame)))
+	print('%-28s %6d %8.2f %8.2f %8.2f %8.2f' % tuple(['load'] + percentiles(t_load)))
+	for name in sorted(log.keys()):
+		print('%-28s %6d %8.2f %8.2f %8.2f %8.2f' % tuple([name] + percentiles(log[name])))
+
+	vo = np.array(vo)
+	result = {'vo': vo}
+	if odom is not None and len(vo):
+		ref = interpolate_odom(odom_stamp, odom, vo[:,0])
+		err = np.linalg.norm(vo[:,1:4] - ref[:,:3], axis=1)
+		length = np.sum(np.linalg.norm(np.diff(ref[:,:3], axis=0), axis=1))
+		# attitude error angle of every pose
+		att = np.linalg.norm((R.from_quat(ref[:,3:]).inv()*R.from_quat(vo[:,4:8])).as_rotvec(), axis=1)
+		print('trajectory: %d poses, %.2f m path, position RMSE %.3f m, max %.3f m, final %.3f m (%.1f%% of path)' % (len(vo),
+			length, np.sqrt(np.mean(err*err)), np.max(err), err[-1], 100.0*err[-1]/max(length, 1e-9)))
+		print('attitude: RMSE %.2f deg, final %.2f deg' % (np.degrees(np.sqrt(np.mean(att*att))), np.degrees(att[-1])))
+		result['odom'] = ref
+	elif not len(vo):
+		print('the VO did not produce a pose')
+
+	if args.out:
+		for name in log:
+			result['stage_' + name] = np.array(log[name])
+		result['frame'] = np.array(t_frame)
+		np.savez(args.out, **result)
+
+if __name__ == '__main__':
+	main()
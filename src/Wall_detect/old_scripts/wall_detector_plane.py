@@ -11,6 +11,7 @@ from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 from scipy.spatial.transform import Rotation as R
 from scipy.linalg import expm, sinm, cosm
+from autobebop.ransac import ransac_plane
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 unused import
 
 bridge = CvBridge()
@@ -207,7 +208,7 @@ def pose_estimation():
 		Z = np.reshape(Z,(-1,1))
 		data = np.concatenate((X_t,Y_t,Z), axis = 1)
 		# print(data)
-		P,res,inlier_no = ransac(data,3,10,0.1)
+		P,res,inlier_no,_ = ransac_plane(data,100,0.1)
 		# print(P)
 		# print(inlier_no*1.0/X_t.shape[0]*1.0)
 		plot_plane_fit(P, list_X_t, list_Y_t, list_z)
@@ -289,47 +290,6 @@ def plot_plane_fit(P, list_X_t, list_Y_t, list_z):
 	surf = ax.plot_surface(X, Y, Z, alpha=0.5)
 	plt.show()
 
-def ransac(data, min_pts, itern, threshDist):
-    d_sh = data.shape
-    num_pts = d_sh[0]
-    num_param = d_sh[1]
-#     bestInNum = 0
-    bestParam = np.zeros(num_param)
-    best_inlier_num = 0
-    for i in range(itern):
-        sample = np.random.permutation(data)[:min_pts,:]
-        A = sample
-        b = -np.ones((len(sample),1))
-        x = np.linalg.lstsq(A,b, rcond=None)[0]
-        # print(x)
-        inlier_pts = []
-        num_inlier = 0
-        for j in range(num_pts):
-			A_pt = data[j,:]
-			b_pt = -1.0
-			dist = abs(np.dot(A_pt,x)-b_pt)/np.linalg.norm(x)
-			# print(dist)
-			if(dist <= threshDist):
-				inlier_pts.append(data[j,:])
-				num_inlier = num_inlier+1
-                
-#         for j in range(num_inlier):
-#             inlier_pts = np.array(inlier_pts)
-#             A = np.concatenate((inlier_pts[:,:-1], np.ones((len(inlier_pts),1))), axis = 1)
-#             b = inlier_pts[:,-1]
-#             x,res,_,_ = np.linalg.lstsq(A,b, rcond=None)
-        if(num_inlier > best_inlier_num):
-            best_inlier_num = num_inlier
-            bestParam = x
-            best_inlier_pts = inlier_pts
-            
-    # print(best_inlier_pts)
-    best_inlier_pts = np.array(best_inlier_pts)
-    A = best_inlier_pts
-    b = -np.ones((len(best_inlier_pts),1))
-    x,res,_,_ = np.linalg.lstsq(A,b, rcond=None)
-    return [x, res, best_inlier_num]
-
 def image_assign(current_image):
 	global image, prev_image
 	# global t_old, dt
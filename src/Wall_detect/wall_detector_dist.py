@@ -10,13 +10,36 @@ from geometry_msgs.msg import Twist
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge, CvBridgeError
 from scipy.spatial.transform import Rotation as R
-from scipy.linalg import expm, sinm, cosm
+from scipy.optimize import least_squares
+from autobebop.camera_model import CameraModel, default_calibration
+from autobebop.debug_images import DebugImage, depth_colors, draw_flow, draw_points, set_rate
+from autobebop.dense_depth import DenseStereo
+from autobebop.detector import GridDetector
+from autobebop.feature_store import FeatureStore
+from autobebop.image_cache import ImageCache
+from autobebop.matching import match_stereo
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 unused import
 
 master_mission_no = 0
 
 bridge = CvBridge()
 
+# gray and color images of the last few messages
+images = ImageCache()
+
+# ORB features of the last few frames, from a grid bucketed detector
+feature_store = FeatureStore(GridDetector())
+
+# largest Hamming distance of an accepted stereo or temporal ORB match
+max_hamming = 64
+
+# dense depth of the two views taken a lateral sweep apart, ~dense_depth param (made in main)
+dense = None
+# calibration the pair is rectified with (~calibration), and the largest median row offset
+# (pixels) of the rectified matches the dense depth is still run at (~dense_max_row_error)
+camera = CameraModel.from_yaml()
+max_row_error = 1.0
+
 # camera Parameters 640x480
 fx = 353.939474
 fy = 353.169928
@@ -54,19 +77,17 @@ Go_pos_b = np.array([0.0, 0.0, 0.0])
 dt_L = 0.0
 t_old = 0.0
 
-#Original image in opencv
-img = np.zeros((480,640,3), np.uint8)
-img_prev = np.zeros((480,640,3), np.uint8)
-
 #ros Images
 image = Image()
 prev_image = Image()
-featured_image = Image()
-temporally_matched_featured_image = Image()
-flow_image = Image()
-wall_image = Image()
 debug_image = Image()
 
+# matches, flow, depth coloured features and wall bounds, only drawn while they have subscribers
+debug_temporal = DebugImage('/temporally_matched_featured_image', "8UC3")
+debug_featured = DebugImage('/featured_image', "8UC3")
+debug_flow = DebugImage('/flow_image', "8UC3")
+debug_wall = DebugImage('/wall_image', "8UC3")
+
 #inertial pose of the wall
 pose_wall_in = Odometry()
 
@@ -75,59 +96,30 @@ vel_VO = Twist()
 
 def pose_estimation(dist):
 	global f, B, cx, cy
-	global image, prev_image, img, img_prev
-	global featured_image
-	global img, dt
-	global temporally_matched_featured_image, flow_image, wall_image
-	global height, width, scale
+	global image, prev_image
+	global dt
+	global height, width
 	global t_old, pos, quat, r_in_b
 	global pose_wall_in, Go_pos_b
 
 	# frame_prev = frame
 	# frame_R_prev = frame_R
 
-	try:
-		img = bridge.imgmsg_to_cv2(image, "bgr8")
-	except CvBridgeError as e:
-		print(e)
+	#gray images, read from the messages without conversion for mono8 (prev_image is cached from the last call)
+	frame = images.gray(image)
+	frame_prev = images.gray(prev_image)
 
-	try:
-		img_prev = bridge.imgmsg_to_cv2(prev_image, "bgr8")
-	except CvBridgeError as e:
-		print(e)
-
-	img_height = len(img)
-	img_width = len(img[0])
-	# print(img_height)
-	# print(img_width)
-
-	#Resize image
-	scale = 1
-	width = int(img.shape[1] * scale)
-	height = int(img.shape[0] * scale)
-	dim = (width, height) #can also just specify desired dimensions
-	# img = cv2.resize(img, dim, interpolation = cv2.INTER_AREA)
-	# img_prev = cv2.resize(img_prev, dim, interpolation = cv2.INTER_AREA)
-
-	#Convert from BGR to gray colorspace
-	frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY);
-	frame_prev = cv2.cvtColor(img_prev, cv2.COLOR_BGR2GRAY);
-
-	img1 = frame.copy()
-	img2 = frame_prev.copy()
-	featured_img = img.copy()
-	flow_img = img.copy()
-	wall_img = img.copy()
-
-	# Initiate ORB detector
-	orb = cv2.ORB_create()
+	#full resolution, the features are extracted at ~pyramid_level and come back in full resolution pixels
+	width = frame.shape[1]
+	height = frame.shape[0]
 
-	# find the keypoints and descriptors with ORB
-	kp1, des1 = orb.detectAndCompute(img1,None)
-	kp2, des2 = orb.detectAndCompute(img2,None)
+	img1 = frame
+	img2 = frame_prev
 
-	# create BFMatcher object
-	bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+	# find the keypoints and descriptors with ORB
+	# prev_image was the current image of an earlier call, so it comes from the store
+	kp1, des1 = feature_store.detect(image.header, img1)
+	kp2, des2 = feature_store.detect(prev_image.header, img2)
 
 	# Initialize lists
 	list_u = []
@@ -137,17 +129,30 @@ def pose_estimation(dist):
 	list_z = []
 	list_vx_img = []
 	list_vy_img = []
-
-	if des2 is not None:
-		# Match descriptors.
-		matches_tm = bf.match(des1,des2)
+	list_u2 = []
+	list_v2 = []
+
+	# matched features in both views and their depth, for the debug images
+	pts1 = np.zeros((0,2))
+	pts2 = np.zeros((0,2))
+	pts_z = np.zeros(0)
+
+	if des1 is not None and des2 is not None:
+		# The sweep between the two views is lateral, so a feature only moves
+		# along its row, by fx*dist/z pixels for the 0.5 to 3 m depths kept below.
+		# Moving left (body y) shifts the scene right in the current view.
+		d_y_b = -sin(yaw)*(pos[0]-pos_prev[0]) + cos(yaw)*(pos[1]-pos_prev[1])
+		d_min = max(4.0, fx*dist/3.0)
+		d_max = min(cx, fx*dist/0.5)
+		if (d_y_b > 0):
+			matches_tm = match_stereo(kp2, des2, kp1, des1, row_tol=50, min_disparity=d_min, max_disparity=d_max, max_distance=max_hamming)
+			matches_tm = [cv2.DMatch(m.trainIdx, m.queryIdx, m.distance) for m in matches_tm]
+		else:
+			matches_tm = match_stereo(kp1, des1, kp2, des2, row_tol=50, min_disparity=d_min, max_disparity=d_max, max_distance=max_hamming)
 
 		# Sort them in the order of their distance.
 		matches_tm = sorted(matches_tm, key = lambda x:x.distance)
 
-		matches_len = len(matches_tm)
-		matches_tm = matches_tm[:int(0.6*matches_len)]
-
 		# print(dt)
 
 		start = 0
@@ -195,22 +200,30 @@ def pose_estimation(dist):
 					list_vx_img.append(vx_img)
 					list_vy_img.append(vy_img)
 
-					z_c = np.clip(int(z*30.0), 0, 120)
-					color_hsv = np.uint8([[[z_c,255,255]]]) 
-					color_bgr = cv2.cvtColor(color_hsv, cv2.COLOR_HSV2BGR)
-					color_plot = (int(color_bgr[0][0][0]),int(color_bgr[0][0][1]),int(color_bgr[0][0][2]))
-					# color = (255, 0, 0) 
-					# print(color_plot)
+					list_u2.append(x2)
+					list_v2.append(y2)
 
-					cv2.circle(featured_img,(int(x1),int(y1)),3,color_plot,-1)
-					cv2.circle(wall_img,(int(x1),int(y1)),3,color_plot,-1)
-					cv2.arrowedLine(flow_img, (int(x2),int(y2)), (int(x1),int(y1)), (0,0,255), thickness=1, line_type=8, shift=0, tipLength=0.5)
+		pts1 = np.column_stack((list_u, list_v))
+		pts2 = np.column_stack((list_u2, list_v2))
+		pts_z = np.asarray(list_z)
 
-		plot_image = cv2.drawMatches(img1,kp1,img2,kp2,matches_tm, None, flags=2)
-		temporally_matched_featured_image = bridge.cv2_to_imgmsg(plot_image, "8UC3")
+		debug_temporal.publish(lambda: cv2.drawMatches(img1,kp1,img2,kp2,matches_tm, None, flags=2))
 
-	flow_image = bridge.cv2_to_imgmsg(flow_img, "8UC3")
-	featured_image = bridge.cv2_to_imgmsg(featured_img, "8UC3")
+		if dense is not None and len(matches_tm):
+			# sweep between the views in the previous camera frame (x right, y down, z forward)
+			d_x_b = cos(yaw)*(pos[0]-pos_prev[0]) + sin(yaw)*(pos[1]-pos_prev[1])
+			C = np.array([-d_y_b, -(pos[2]-pos_prev[2]), d_x_b])
+			cloud = dense_cloud(img1, img2, kp1, kp2, matches_tm, C)
+			if cloud is not None and len(cloud[0]) > 60:
+				pts, uv = cloud
+				list_u = uv[:,0].tolist()
+				list_v = uv[:,1].tolist()
+				list_X_t = pts[:,0].tolist()
+				list_Y_t = pts[:,1].tolist()
+				list_z = pts[:,2].tolist()
+
+	debug_flow.publish(lambda: draw_flow(images.color(image).copy(), pts2, pts1))
+	debug_featured.publish(lambda: draw_points(images.color(image).copy(), pts1, depth_colors(pts_z)))
 
 	if len(list_z)>60:
 
@@ -230,7 +243,7 @@ def pose_estimation(dist):
 		Z = np.reshape(Z,(-1,1))
 		# data = np.concatenate((X_t,Y_t,Z), axis = 1)
 		# print(data)
-		# P,res,inlier_no = ransac(data,3,10,2.0)
+		# P,res,inlier_no,_ = ransac_plane(data,100,2.0)
 		# plot_plane_fit(P, list_X_t, list_Y_t, list_z)
 		# roll_p, pitch_p, h = get_rph_from_plane(P)
 
@@ -272,15 +285,79 @@ def pose_estimation(dist):
 
 		# rospy.loginfo('Wall depth %f \t Lower_Edge %f \t Upper_Edge %f \t Lateral shift %f',Wall_Z, Wall_Lower, Wall_Upper, Wall_X)
 
-		cv2.line(wall_img, (0,V_min), (width,V_min), (0,0,255), 2, cv2.LINE_AA) 
-		cv2.line(wall_img, (0,V_max), (width,V_max), (255,0,0), 2, cv2.LINE_AA) 
-
-		cv2.line(wall_img, (U_max,0), (U_max,height), (0,0,255), 2, cv2.LINE_AA) 
-		cv2.line(wall_img, (U_min,0), (U_min,height), (255,0,0), 2, cv2.LINE_AA) 
-
 		# plot_points(list_X_t, list_Y_t, list_z)
 
-		wall_image = bridge.cv2_to_imgmsg(wall_img, "8UC3")
+		debug_wall.publish(lambda: draw_wall(draw_points(images.color(image).copy(), pts1, depth_colors(pts_z)), U_min, U_max, V_min, V_max))
+
+def sweep_rotation(x1, x2, C):
+	# rotation Rot (x1 = Rot x2 + T, T = -Rot C) between the previous view and the current
+	# one at C (previous camera frame), from the undistorted normalized matches x2 and x1,
+	# and the Sampson error (pixels) of every match
+	h1 = np.column_stack((x1, np.ones(len(x1))))
+	h2 = np.column_stack((x2, np.ones(len(x2))))
+	def residuals(r):
+		Rot = cv2.Rodrigues(r)[0]
+		E = np.cross(-np.dot(Rot, C), Rot.T).T
+		Ex2 = np.dot(h2, E.T)
+		Etx1 = np.dot(h1, E)
+		num = np.sum(h1*Ex2, axis=1)
+		return fx*num/np.sqrt(Ex2[:,0]**2 + Ex2[:,1]**2 + Etx1[:,0]**2 + Etx1[:,1]**2 + 1e-12)
+	sol = least_squares(residuals, np.zeros(3), loss='huber', f_scale=1.0)
+	return [cv2.Rodrigues(sol.x)[0], residuals(sol.x)]
+
+def dense_cloud(img1, img2, kp1, kp2, matches, C):
+	"""
+	Dense points (Nx3, current camera frame) and their current view pixels of
+	the current view img1 and the previous view img2, whose centres are C
+	(previous camera frame, from odom) apart
+
+	The two views are distorted and the image attitude changes over the
+	sweep, so the pair is rectified first: the sweep comes from odom, the
+	rotation between the views from the matches (the stabilized image does
+	not follow the body attitude). None when the matches are still more
+	than max_row_error pixels off their rows once rectified (the sparse
+	points are kept then).
+	"""
+	if len(matches) < 8:
+		return None
+	p1 = np.float64([kp1[m.queryIdx].pt for m in matches])
+	p2 = np.float64([kp2[m.trainIdx].pt for m in matches])
+	K = camera.camera_matrix
+	x1 = cv2.undistortPoints(p1.reshape(-1,1,2), K, camera.dist_coeffs).reshape(-1,2)
+	x2 = cv2.undistortPoints(p2.reshape(-1,1,2), K, camera.dist_coeffs).reshape(-1,2)
+	Rot, res = sweep_rotation(x1, x2, C)
+	T = -np.dot(Rot, C)
+	inliers = np.abs(res) < 2.0
+	if np.count_nonzero(inliers) < 8:
+		return None
+
+	# the view on the right of the other one is the second (right) camera
+	prev_left = C[0] > 0
+	if prev_left:
+		left, right, p_left, p_right = img2, img1, p2, p1
+		R_lr, T_lr = Rot, T
+	else:
+		left, right, p_left, p_right = img1, img2, p1, p2
+		R_lr, T_lr = Rot.T, C
+	R1, R2, P1, P2, maps1, maps2 = camera.stereo_rectify(R_lr, T_lr)
+
+	row_error = np.median(np.abs(camera.rectify_points(p_left[inliers], R1, P1)[:,1] - camera.rectify_points(p_right[inliers], R2, P2)[:,1]))
+	if row_error > max_row_error:
+		rospy.logdebug('wall pair rows %.1f px apart once rectified, dense depth skipped', row_error)
+		return None
+
+	# the matcher takes the pair swapped, its points are in the rectified right camera frame
+	left = cv2.remap(left, maps1[0], maps1[1], cv2.INTER_LINEAR)
+	right = cv2.remap(right, maps2[0], maps2[1], cv2.INTER_LINEAR)
+	cloud = dense.compute(right, left, B=np.linalg.norm(C), P=P2)
+	if cloud is None:
+		return None
+	pts = np.dot(cloud[0], R2)
+	if not prev_left:
+		pts = np.dot(pts, Rot.T) + T
+	pts = pts[pts[:,2] > 0]
+	uv = np.column_stack((fx*pts[:,0]/pts[:,2] + cx, fy*pts[:,1]/pts[:,2] + cy))
+	return [pts, uv]
 
 def pose_b2in(pose_rel):
 	global pos_in, yaw, quat
@@ -321,6 +398,14 @@ def pose_b2in(pose_rel):
 
 	rospy.loginfo('Go to x %f \t y %f \t z %f', x_obj, y_obj, z_obj)
 
+def draw_wall(wall_img, U_min, U_max, V_min, V_max):
+	cv2.line(wall_img, (0,V_min), (width,V_min), (0,0,255), 2, cv2.LINE_AA) 
+	cv2.line(wall_img, (0,V_max), (width,V_max), (255,0,0), 2, cv2.LINE_AA) 
+
+	cv2.line(wall_img, (U_max,0), (U_max,height), (0,0,255), 2, cv2.LINE_AA) 
+	cv2.line(wall_img, (U_min,0), (U_min,height), (255,0,0), 2, cv2.LINE_AA) 
+	return wall_img
+
 def plot_points(list_X_t, list_Y_t, list_z):
 
 	fig = plt.figure()
@@ -361,24 +446,6 @@ def quaternion_to_euler(w, x, y, z):
 	# return [yaw, pitch, roll
 	return [roll, pitch, yaw]
 
-def skew(v):
-	""" 
-	Returns the skew-symmetric matrix of a vector
-	Ref: https://github.com/dreamdragon/Solve3Plus1/blob/master/skew3.m
-
-	Also known as the cross-product matrix [v]_x such that 
-	the cross product of (v x w) is equivalent to the 
-	matrix multiplication of the cross product matrix of 
-	v ([v]_x) and w
-
-	In other words: v x w = [v]_x * w
-	"""
-	sk = np.float32([[0, -v[2], v[1]],
-	           		[v[2], 0, -v[0]],
-	           		[-v[1], v[0], 0]])
-
-	return sk
-
 def get_odom(data):
 	global pos, vel, pos_prev, vel_prev
 	global image, prev_image
@@ -408,7 +475,9 @@ def get_odom(data):
 			dist = np.linalg.norm(pos-pos_prev)
 			# print(dist)
 
-			pose_estimation(dist)
+			# no estimate before a frame was taken at the previous reversal
+			if image.data and prev_image.data:
+				pose_estimation(dist)
 
 			pos_prev = np.copy(pos)
 
@@ -461,13 +530,20 @@ def get_master_mission(data):
 pub_pose_wall_in = rospy.Publisher('/pose_wall_in', Odometry, queue_size=10)
 
 def main():
+	global dense, camera, max_row_error
 	rospy.init_node('wall_detect', anonymous=True)
 
+	camera = CameraModel.from_yaml(rospy.get_param('~calibration', default_calibration))
+	max_row_error = rospy.get_param('~dense_max_row_error', max_row_error)
+
+	if rospy.get_param('~dense_depth', False):
+		dense = DenseStereo(fx, 0.0, cx, cy, level=rospy.get_param('~dense_level', 2), num_disparities=64, method=rospy.get_param('~dense_method', 'sgbm'),
+			budget=rospy.get_param('~dense_budget', 0.05), min_depth=0.5, max_depth=3.0)
+
 	pub_debug_image = rospy.Publisher('/debug_image', Image, queue_size=10)
-	pub_featured_image = rospy.Publisher('/featured_image', Image, queue_size=10)
-	pub_temporally_matched_featured_image = rospy.Publisher('/temporally_matched_featured_image', Image, queue_size=10)
-	pub_flow_image = rospy.Publisher('/flow_image', Image, queue_size=10)
-	pub_wall_image = rospy.Publisher('/wall_image', Image, queue_size=10)
+	set_rate([debug_temporal, debug_featured, debug_flow, debug_wall], rospy.get_param('~debug_rate', 5.0))
+	# pyramid level of the ORB extraction, the keypoints come back in full resolution pixels
+	feature_store.detector.level = rospy.get_param('~pyramid_level', feature_store.detector.level)
 
 	rospy.Subscriber('/image_raw', Image, image_assign)
 	rospy.Subscriber('/pose_in', Odometry, get_pose_in)
@@ -487,10 +563,6 @@ def main():
 
 			# pose_estimation()
 		
-			pub_temporally_matched_featured_image.publish(temporally_matched_featured_image)
-			pub_featured_image.publish(featured_image)
-			pub_flow_image.publish(flow_image)
-			pub_wall_image.publish(wall_image)
 			pub_debug_image.publish(debug_image)
 
 			pub_pose_wall_in.publish(pose_wall_in)
@@ -0,0 +1,99 @@
+import numpy as np
+
+# quaternions are [x, y, z, w] like scipy's Rotation.as_quat, and every function
+# also takes stacks of them (Nx4, Nx3 for vectors)
+
+def quat_multiply(p, q):
+	# Hamilton product p*q, the rotation q followed by p (same as Rotation p*q)
+	p = np.asarray(p, dtype=np.float64)
+	q = np.asarray(q, dtype=np.float64)
+	px, py, pz, pw = p[...,0], p[...,1], p[...,2], p[...,3]
+	qx, qy, qz, qw = q[...,0], q[...,1], q[...,2], q[...,3]
+	return np.stack((pw*qx + px*qw + py*qz - pz*qy,
+		pw*qy - px*qz + py*qw + pz*qx,
+		pw*qz + px*qy - py*qx + pz*qw,
+		pw*qw - px*qx - py*qy - pz*qz), axis=-1)
+
+def quat_conjugate(q):
+	# inverse rotation of the unit quaternion q
+	q = np.array(q, dtype=np.float64)
+	q[...,:3] = -q[...,:3]
+	return q
+
+def quat_to_dcm(q):
+	# rotation matrix of q, same as Rotation.from_quat(q).as_dcm()
+	x, y, z, w = np.asarray(q, dtype=np.float64)
+	return np.array([[1.0 - 2.0*(y*y + z*z), 2.0*(x*y - z*w), 2.0*(x*z + y*w)],
+		[2.0*(x*y + z*w), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z - x*w)],
+		[2.0*(x*z - y*w), 2.0*(y*z + x*w), 1.0 - 2.0*(x*x + y*y)]])
+
+def quat_exp(rotvec):
+	"""
+	Quaternion of the rotation vector (axis times angle), the closed form of
+	expm(skew(rotvec)) without the general matrix exponential
+	"""
+	rotvec = np.asarray(rotvec, dtype=np.float64)
+	theta = np.sqrt(np.sum(rotvec*rotvec, axis=-1))
+	half = 0.5*theta
+	# sin(theta/2)/theta, with its series for small angles
+	small = theta < 1e-6
+	k = np.where(small, 0.5 - theta*theta/48.0, np.sin(half)/np.where(small, 1.0, theta))
+	return np.concatenate((rotvec*k[...,np.newaxis], np.cos(half)[...,np.newaxis]), axis=-1)
+
+def quat_log(q):
+	# rotation vector of the unit quaternion q, inverse of quat_exp
+	q = np.asarray(q, dtype=np.float64)
+	if q[3] < 0:
+		q = -q
+	s = np.linalg.norm(q[:3])
+	if s < 1e-9:
+		return 2.0*q[:3]
+	return 2.0*np.arctan2(s, q[3])*q[:3]/s
+
+def integrate_attitude(quat, omega, dt):
+	"""
+	Integrates the body rate omega (inertial axes) over dt starting from quat,
+	quat_new = exp(dt*omega)*quat
+
+	With a stack of rates (Nx3) and N time steps (or one dt for all) the
+	increments are computed together and composed in order, and the Nx4
+	attitudes after every step are returned
+	"""
+	omega = np.asarray(omega, dtype=np.float64)
+	dt = np.asarray(dt, dtype=np.float64)
+	if omega.ndim == 1:
+		q = quat_multiply(quat_exp(dt*omega), quat)
+		return q/np.linalg.norm(q)
+
+	dq = quat_exp(np.reshape(dt, (-1,1))*omega)
+	out = np.zeros((len(omega), 4))
+	q = np.asarray(quat, dtype=np.float64)
+	for i in range(len(omega)):
+		q = quat_multiply(dq[i], q)
+		q = q/np.linalg.norm(q)
+		out[i] = q
+	return out
+
+def quat_to_euler_zyx(q):
+	"""
+	Angles [a, b, c] of Rotation.as_euler('zyx'), the extrinsic rotation about
+	z by a, then y by b, then x by c
+	"""
+	q = np.asarray(q, dtype=np.float64)
+	x, y, z, w = q[...,0], q[...,1], q[...,2], q[...,3]
+	a = np.arctan2(2.0*(w*z - x*y), 1.0 - 2.0*(y*y + z*z))
+	b = np.arcsin(np.clip(2.0*(w*y + z*x), -1.0, 1.0))
+	c = np.arctan2(2.0*(w*x - y*z), 1.0 - 2.0*(x*x + y*y))
+	return np.stack((a, b, c), axis=-1)
+
+def quat_from_euler_zyx(angles):
+	# inverse of quat_to_euler_zyx, same as Rotation.from_euler('zyx', angles).as_quat()
+	angles = np.asarray(angles, dtype=np.float64)
+	half = 0.5*angles
+	ca, cb, cc = np.cos(half[...,0]), np.cos(half[...,1]), np.cos(half[...,2])
+	sa, sb, sc = np.sin(half[...,0]), np.sin(half[...,1]), np.sin(half[...,2])
+	zero = np.zeros_like(ca)
+	qz = np.stack((zero, zero, sa, ca), axis=-1)
+	qy = np.stack((zero, sb, zero, cb), axis=-1)
+	qx = np.stack((sc, zero, zero, cc), axis=-1)
+	return quat_multiply(qx, quat_multiply(qy, qz))
@@ -0,0 +1,111 @@
+import os
+import cv2
+import numpy as np
+import yaml
+
+try:
+	import rospkg
+except ImportError:
+	rospkg = None
+
+def package_path():
+	# AutoBebop package directory (source, devel or install space) through rospkg,
+	# the source tree around this file when the package is not on ROS_PACKAGE_PATH
+	if rospkg is not None:
+		try:
+			return rospkg.RosPack().get_path('AutoBebop')
+		except rospkg.ResourceNotFound:
+			pass
+	return os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# calibration of the bebop front camera (the large FOV setting), in the camera_info YAML format
+default_calibration = os.path.join(package_path(), 'cfg', 'bebop_camera.yaml')
+
+def load_calibration(path):
+	# [K (3x3), distortion coefficients, width, height] of a camera_info YAML (camera_calibration output)
+	with open(path) as f:
+		calib = yaml.safe_load(f)
+	K = np.array(calib['camera_matrix']['data'], dtype=np.float64).reshape(3,3)
+	D = np.array(calib['distortion_coefficients']['data'], dtype=np.float64)
+	return [K, D, int(calib['image_width']), int(calib['image_height'])]
+
+class CameraModel(object):
+	"""
+	Pinhole camera with plumb bob distortion, loaded once from a calibration
+
+	remap() undistorts a whole frame through fixed-point (CV_16SC2) maps
+	computed once per pyramid level, undistort_points() undistorts only the
+	given pixels and project() projects 3D points with the distortion, so a
+	detector that only needs a few corners never touches the whole frame.
+	Level k is the frame halved k times by pyrDown (image_cache), its pixel x
+	is pixel 2**k x of the full resolution frame.
+	"""
+
+	def __init__(self, K, D, width, height):
+		self.camera_matrix = np.asarray(K, dtype=np.float64)
+		self.dist_coeffs = np.asarray(D, dtype=np.float64).ravel()
+		self.width = width
+		self.height = height
+		self.maps = {}
+
+	@classmethod
+	def from_yaml(cls, path=default_calibration):
+		return cls(*load_calibration(path))
+
+	def matrix(self, level=0):
+		# camera matrix of the pyramid level
+		K = self.camera_matrix.copy()
+		K[:2] = K[:2]*0.5**level
+		return K
+
+	def size(self, level=0):
+		# (width, height) of the pyramid level, like pyrDown rounds it
+		width, height = self.width, self.height
+		for i in range(level):
+			width, height = (width+1)//2, (height+1)//2
+		return (width, height)
+
+	def undistort_maps(self, level=0):
+		if level not in self.maps:
+			K = self.matrix(level)
+			self.maps[level] = cv2.initUndistortRectifyMap(K, self.dist_coeffs, None, K, self.size(level), cv2.CV_16SC2)
+		return self.maps[level]
+
+	def remap(self, frame, level=0, roi=None):
+		# undistorted frame of the pyramid level, same camera matrix, only its
+		# (x0, y0, x1, y1) region with a roi (through the same maps, sliced)
+		map1, map2 = self.undistort_maps(level)
+		if roi is not None:
+			x0, y0, x1, y1 = roi
+			map1 = map1[y0:y1,x0:x1]
+			map2 = map2[y0:y1,x0:x1]
+		return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+	def stereo_rectify(self, R, T):
+		# rectification of this camera with a second view of it at x2 = R x1 + T
+		# (second view on the right, T about (-B, 0, 0)): [R1, R2, P1, P2, maps1,
+		# maps2], full resolution remap maps of the two views
+		K = self.camera_matrix
+		size = self.size()
+		R1, R2, P1, P2 = cv2.stereoRectify(K, self.dist_coeffs, K, self.dist_coeffs, size, np.asarray(R, dtype=np.float64), np.asarray(T, dtype=np.float64).reshape(3,1), flags=cv2.CALIB_ZERO_DISPARITY, alpha=0)[:4]
+		maps1 = cv2.initUndistortRectifyMap(K, self.dist_coeffs, R1, P1, size, cv2.CV_16SC2)
+		maps2 = cv2.initUndistortRectifyMap(K, self.dist_coeffs, R2, P2, size, cv2.CV_16SC2)
+		return [R1, R2, P1, P2, maps1, maps2]
+
+	def rectify_points(self, pts, Rr, P):
+		# rectified pixels (Nx2) of the distorted full resolution pixels pts of a view rectified by Rr, P
+		pts = np.asarray(pts, dtype=np.float64).reshape(-1,1,2)
+		return cv2.undistortPoints(pts, self.camera_matrix, self.dist_coeffs, R=Rr, P=P).reshape(-1,2)
+
+	def undistort_points(self, pts, level=0):
+		# undistorted pixels (Nx2) of the distorted pixels pts of the pyramid level
+		pts = np.asarray(pts, dtype=np.float64).reshape(-1,1,2)
+		if len(pts) == 0:
+			return pts.reshape(-1,2)
+		K = self.matrix(level)
+		return cv2.undistortPoints(pts, K, self.dist_coeffs, P=K).reshape(-1,2)
+
+	def project(self, X, rvec, tvec, level=0):
+		# distorted pixels (Nx2) of the 3D points X (Nx3) in the frame rvec, tvec
+		pts, _ = cv2.projectPoints(np.asarray(X, dtype=np.float64).reshape(-1,1,3), rvec, tvec, self.matrix(level), self.dist_coeffs)
+		return pts.reshape(-1,2)
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+# colour spaces the models can be defined in, converted from BGR
+spaces = {'bgr': None, 'hsv': cv2.COLOR_BGR2HSV, 'lab': cv2.COLOR_BGR2LAB, 'ycrcb': cv2.COLOR_BGR2YCrCb}
+
+def bin_colors(bits):
+	# BGR centre (Nx3 uint8) of every bin of the cube quantized to bits per channel, in table order
+	q = (np.arange(1 << bits) << (8 - bits)) + (1 << (7 - bits))
+	b, g, r = np.meshgrid(q, q, q, indexing='ij')
+	return np.column_stack((b.ravel(), g.ravel(), r.ravel())).astype(np.uint8)
+
+def convert(colors, space):
+	# Nx3 uint8 BGR colors in the colour space
+	if spaces[space] is None:
+		return colors
+	return cv2.cvtColor(colors.reshape(-1,1,3), spaces[space]).reshape(-1,3)
+
+class ColorLUT(object):
+	"""
+	Pixel classifier as a lookup table over the BGR cube quantized to bits
+	per channel
+
+	Any colour model is compiled once into a score (0-255) per bin, so a
+	frame is classified in a single pass on BGR whatever the model costs per
+	pixel: no colour conversion and no per-pixel arithmetic. box() compiles
+	an inRange box, gaussian() a single Gaussian likelihood, train() a table
+	from labelled frames (saved and loaded as npz). A pixel belongs to the
+	class when its score is at least 128, segment() optionally box-filters
+	the scores first (a majority vote over the neighbourhood, in place of
+	blurring the 3 channel image before thresholding).
+	"""
+
+	def __init__(self, table, bits=5):
+		self.bits = bits
+		self.table = np.ascontiguousarray(table, dtype=np.uint8).ravel()
+		if len(self.table) != 1 << (3*bits):
+			raise ValueError('a %d bit table has %d entries, not %d' % (bits, 1 << (3*bits), len(self.table)))
+		# per channel tables of the shifted bin index, the index of a pixel is their sum
+		dtype = np.uint16 if 3*bits <= 16 else np.int32
+		q = np.arange(256) >> (8 - bits)
+		self.index = [(q << (2*bits)).astype(dtype), (q << bits).astype(dtype), q.astype(dtype)]
+
+	@classmethod
+	def box(cls, lower, upper, space='hsv', bits=5):
+		# colours inside [lower, upper] of the colour space, like cv2.inRange
+		colors = convert(bin_colors(bits), space).reshape(-1,1,3)
+		return cls(cv2.inRange(colors, tuple(lower), tuple(upper)).ravel(), bits)
+
+	@classmethod
+	def gaussian(cls, mu, sigma, threshold, space='hsv', scale=1.0/255, bits=5):
+		# colours of the colour space (times scale) whose Gaussian likelihood exceeds threshold, score 127.5 at threshold
+		x = convert(bin_colors(bits), space)*scale - np.asarray(mu)
+		sigma = np.asarray(sigma, dtype=np.float64)
+		v = -0.5*np.sum(x*np.dot(x, np.linalg.inv(sigma)), axis=1)
+		P = np.exp(v)/(((2*np.pi)**1.5)*np.sqrt(np.linalg.det(sigma)))
+		return cls(np.floor(255*np.clip(P/(2.0*threshold), 0.0, 1.0)), bits)
+
+	@classmethod
+	def train(cls, images, masks, bits=5, prior=1.0):
+		# table of the fraction of the labelled pixels of every bin that are in the masks (nonzero), prior counts as negatives
+		pos = np.zeros(1 << (3*bits))
+		total = np.zeros(1 << (3*bits))
+		lut = cls(np.zeros(1 << (3*bits)), bits)
+		for image, mask in zip(images, masks):
+			idx = lut.indices(image).ravel()
+			total = total + np.bincount(idx, minlength=len(total))
+			pos = pos + np.bincount(idx, weights=(np.asarray(mask).ravel() > 0), minlength=len(pos))
+		return cls(np.floor(255*pos/(total + prior)), bits)
+
+	@classmethod
+	def load(cls, path):
+		data = np.load(path)
+		return cls(data['table'], int(data['bits']))
+
+	def save(self, path):
+		np.savez(path, table=self.table, bits=self.bits)
+
+	def indices(self, bgr):
+		b, g, r = cv2.split(bgr)
+		return cv2.add(cv2.add(cv2.LUT(b, self.index[0]), cv2.LUT(g, self.index[1])), cv2.LUT(r, self.index[2]))
+
+	def scores(self, bgr):
+		return self.table.take(self.indices(bgr))
+
+	def segment(self, bgr, blur=0):
+		# 0/255 mask of the pixels of the class, scores averaged over blur x blur first
+		scores = self.scores(bgr)
+		if blur > 1:
+			scores = cv2.blur(scores, (blur, blur))
+		return cv2.threshold(scores, 127, 255, cv2.THRESH_BINARY)[1]
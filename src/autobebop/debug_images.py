@@ -0,0 +1,74 @@
+import time
+import cv2
+import numpy as np
+import rospy
+from cv_bridge import CvBridge
+from sensor_msgs.msg import Image
+
+bridge = CvBridge()
+
+class DebugImage(object):
+	"""
+	Debug image topic that is only rendered and serialized when it has
+	subscribers, at most rate times per second (every frame for rate <= 0)
+
+	publish() takes the image or a callable that draws it. The callable is
+	only called when the image goes out, so the copies and the drawing cost
+	nothing while nobody listens. The publisher is only advertised on the
+	first call, so the nodes can make their debug images at import time,
+	before rospy.init_node.
+	"""
+
+	def __init__(self, topic, encoding='bgr8', rate=5.0, queue_size=1):
+		self.topic = topic
+		self.queue_size = queue_size
+		self.pub = None
+		self.encoding = encoding
+		self.rate = rate
+		self.t_last = None
+
+	def wanted(self):
+		if self.pub is None:
+			self.pub = rospy.Publisher(self.topic, Image, queue_size=self.queue_size)
+		if self.pub.get_num_connections() == 0:
+			return False
+		return self.rate <= 0 or self.t_last is None or time.time() - self.t_last >= 1.0/self.rate
+
+	def publish(self, image, header=None):
+		# True when the image went out
+		if not self.wanted():
+			return False
+		self.t_last = time.time()
+		if callable(image):
+			image = image()
+		if image is None:
+			return False
+		msg = bridge.cv2_to_imgmsg(np.asarray(image), self.encoding)
+		if header is not None:
+			msg.header = header
+		self.pub.publish(msg)
+		return True
+
+def set_rate(debug_images, rate):
+	for debug in debug_images:
+		debug.rate = rate
+
+def depth_colors(z, scale=30.0, max_hue=120):
+	# BGR colour of every depth z, the hue runs from red (near) to green (far)
+	hue = np.clip((np.asarray(z, dtype=np.float64)*scale).astype(int), 0, max_hue).astype(np.uint8)
+	if len(hue) == 0:
+		return np.zeros((0,3), np.uint8)
+	hsv = np.column_stack((hue, np.full(len(hue), 255, np.uint8), np.full(len(hue), 255, np.uint8)))
+	return cv2.cvtColor(hsv.reshape(-1,1,3), cv2.COLOR_HSV2BGR).reshape(-1,3)
+
+def draw_flow(image, X_from, X_to, color=(0,0,255)):
+	# arrow from every X_from point to its X_to point, drawn on image
+	for (x0,y0),(x1,y1) in zip(X_from, X_to):
+		cv2.arrowedLine(image, (int(x0),int(y0)), (int(x1),int(y1)), color, thickness=1, line_type=8, shift=0, tipLength=0.5)
+	return image
+
+def draw_points(image, pts, colors, radius=3):
+	# filled circle of its colour at every point, drawn on image
+	for (x,y),c in zip(pts, colors):
+		cv2.circle(image, (int(x),int(y)), radius, (int(c[0]),int(c[1]),int(c[2])), -1)
+	return image
@@ -0,0 +1,105 @@
+import time
+import cv2
+import numpy as np
+
+class DenseStereo(object):
+	"""
+	Dense depth from a rectified pair by semi-global ('sgbm') or block ('bm')
+	matching on the pair downscaled level times by pyrDown
+
+	The disparity is x_right - x_left like in matching.motion_field (the
+	DUO3D pair), so the matcher runs on the swapped pair. The image is
+	matched in horizontal bands from the center row outwards and the bands
+	left when budget seconds have passed are skipped, which bounds the time
+	of a frame to budget plus one band. With a rate (Hz) compute() only runs
+	when 1/rate seconds have passed since its last run.
+	"""
+
+	def __init__(self, f, B, cx, cy, level=1, num_disparities=16, block_size=5, method='sgbm', step=2, bands=6, budget=0.02, rate=0.0, min_depth=0.2, max_depth=5.0):
+		self.f = f
+		self.B = B
+		self.cx = cx
+		self.cy = cy
+		self.level = level
+		self.step = step
+		self.bands = bands
+		self.budget = budget
+		self.rate = rate
+		self.min_depth = min_depth
+		self.max_depth = max_depth
+		self.t_last = None
+		# rows a band is padded with so the matching window sees its neighbours
+		self.pad = block_size
+		self.num_disparities = 16*max(1, int(np.ceil(num_disparities/16.0)))
+		if (method == 'bm'):
+			self.matcher = cv2.StereoBM_create(numDisparities=self.num_disparities, blockSize=max(5, block_size | 1))
+		else:
+			self.matcher = cv2.StereoSGBM_create(minDisparity=0, numDisparities=self.num_disparities, blockSize=block_size,
+				P1=8*block_size*block_size, P2=32*block_size*block_size, uniquenessRatio=10, speckleWindowSize=50, speckleRange=2)
+
+	def due(self, t):
+		return self.rate <= 0 or self.t_last is None or t - self.t_last >= 1.0/self.rate
+
+	def downscale(self, frame):
+		for i in range(self.level):
+			frame = cv2.pyrDown(frame)
+		return frame
+
+	def disparity(self, left, right, deadline):
+		# disparity of the downscaled left frame, -1 where invalid or not computed
+		h = left.shape[0]
+		disp = -np.ones(left.shape[:2], np.float32)
+		edges = np.linspace(0, h, self.bands+1).astype(int)
+		order = np.argsort(np.abs(0.5*(edges[:-1] + edges[1:]) - 0.5*h), kind='mergesort')
+		for i in order:
+			if time.time() > deadline:
+				break
+			r0, r1 = edges[i], edges[i+1]
+			p0 = max(0, r0 - self.pad)
+			p1 = min(h, r1 + self.pad)
+			# matched as right-left, the disparity lands on the right image pixels
+			d = self.matcher.compute(right[p0:p1], left[p0:p1]).astype(np.float32)/16.0
+			disp[r0:r1] = d[r0-p0:r1-p0]
+		return disp
+
+	def compute(self, left, right, t=None, B=None, P=None):
+		"""
+		Subsampled point cloud of the gray pair (left, right), with the baseline
+		B and the focal length and principal point of the projection matrix P
+		(of a rectified pair) when given instead of the ones of the constructor
+
+		Returns [pts, uv, d] with pts the Nx3 points in the left camera frame,
+		uv their full resolution left image pixels and d their full resolution
+		disparity, or None when not due or nothing was matched
+		"""
+		if t is not None:
+			if not self.due(t):
+				return None
+			self.t_last = t
+		deadline = time.time() + self.budget
+		if B is None:
+			B = self.B
+		f, cx, cy = self.f, self.cx, self.cy
+		if P is not None:
+			f, cx, cy = P[0,0], P[0,2], P[1,2]
+
+		s = 2**self.level
+		small_left = self.downscale(left)
+		small_right = self.downscale(right)
+		disp = self.disparity(small_left, small_right, deadline)
+
+		# disparity is on the right image, its left image pixel is u - d
+		rows, cols = np.mgrid[0:disp.shape[0]:self.step, 0:disp.shape[1]:self.step]
+		d = disp[rows, cols]
+		valid = d > 0
+		d = d[valid]*s
+		u = cols[valid]*s - d
+		v = rows[valid]*float(s)
+		z = f*B/d
+		keep = (z > self.min_depth) & (z < self.max_depth)
+		if not np.any(keep):
+			return None
+		u, v, z, d = u[keep], v[keep], z[keep], d[keep]
+
+		pts = np.column_stack(((u - cx)/f*z, (v - cy)/f*z, z))
+		return [pts, np.column_stack((u, v)), d]
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+from autobebop.matching import keypoint_coords
+
+def scale_keypoints(kp, s):
+	# copies of the keypoints with coordinates and size multiplied by s
+	return [cv2.KeyPoint(k.pt[0]*s, k.pt[1]*s, k.size*s, k.angle, k.response, k.octave, k.class_id) for k in kp]
+
+class GridDetector(object):
+	"""
+	ORB detector that spreads its feature budget evenly over the image
+
+	ORB is run once with oversample times the budget and a low FAST threshold.
+	The frame is tiled into a rows x cols grid and every cell keeps at most
+	its share of the max_features strongest keypoints. Slots left over by
+	low-texture cells go to the strongest remaining keypoints anywhere.
+	With level > 0 extraction runs on the frame downscaled level times by
+	pyrDown and the keypoints are returned in full resolution coordinates.
+
+	Has the detect / compute / detectAndCompute interface of cv2.ORB so it can
+	be used wherever the ORB instance was.
+	"""
+
+	def __init__(self, max_features=500, rows=6, cols=8, level=0, oversample=4, fast_threshold=10):
+		self.max_features = max_features
+		self.rows = rows
+		self.cols = cols
+		self.level = level
+		self.cell_budget = max(1, max_features//(rows*cols))
+		self.orb = cv2.ORB_create(nfeatures=oversample*max_features, fastThreshold=fast_threshold)
+
+	def downscale(self, frame):
+		for i in range(self.level):
+			frame = cv2.pyrDown(frame)
+		return frame
+
+	def select(self, kp, shape):
+		# strongest keypoints of every grid cell, then the best of the rest
+		if len(kp) <= self.max_features:
+			return list(kp)
+		height, width = shape[:2]
+		pts = keypoint_coords(kp)
+		response = np.array([k.response for k in kp])
+		row = np.clip((pts[:,1]*self.rows/height).astype(int), 0, self.rows-1)
+		col = np.clip((pts[:,0]*self.cols/width).astype(int), 0, self.cols-1)
+		cell = row*self.cols + col
+
+		order = np.lexsort((-response, cell))
+		cell_sorted = cell[order]
+		rank = np.arange(len(order)) - np.searchsorted(cell_sorted, cell_sorted, side='left')
+		selected = order[rank < self.cell_budget]
+		rest = order[rank >= self.cell_budget]
+		rest = rest[np.argsort(-response[rest], kind='mergesort')]
+		selected = np.concatenate((selected, rest[:max(0, self.max_features - len(selected))]))
+		selected = selected[np.argsort(-response[selected], kind='mergesort')][:self.max_features]
+		return [kp[i] for i in selected]
+
+	def detect(self, frame, mask=None):
+		small = self.downscale(frame)
+		if mask is not None and self.level > 0:
+			mask = cv2.resize(mask, (small.shape[1], small.shape[0]), interpolation = cv2.INTER_NEAREST)
+		kp = self.select(self.orb.detect(small, mask), small.shape)
+		return scale_keypoints(kp, 2**self.level) if self.level > 0 else kp
+
+	def compute(self, frame, kp):
+		if self.level == 0:
+			return self.orb.compute(frame, kp)
+		s = 2**self.level
+		small_kp = scale_keypoints(kp, 1.0/s)
+		for i in range(len(small_kp)):
+			small_kp[i].class_id = i
+		small_kp, des = self.orb.compute(self.downscale(frame), small_kp)
+		# keep the attributes (class_id) of the keypoints that were passed in
+		kp = [kp[k.class_id] for k in small_kp]
+		return kp, des
+
+	def detectAndCompute(self, frame, mask=None):
+		small = self.downscale(frame)
+		if mask is not None and self.level > 0:
+			mask = cv2.resize(mask, (small.shape[1], small.shape[0]), interpolation = cv2.INTER_NEAREST)
+		kp = self.select(self.orb.detect(small, mask), small.shape)
+		kp, des = self.orb.compute(small, kp)
+		return (scale_keypoints(kp, 2**self.level) if self.level > 0 else kp), des
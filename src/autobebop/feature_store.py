@@ -0,0 +1,45 @@
+import cv2
+from collections import OrderedDict
+
+class FeatureStore(object):
+	"""
+	Keeps the keypoints and descriptors of the last few frames, keyed by the
+	header (stamp and seq) of the image message they were extracted from.
+	A frame is detected once and reused when it comes back as the previous
+	frame for temporal matching.
+	"""
+
+	def __init__(self, detector=None, size=4):
+		if detector is None:
+			detector = cv2.ORB_create()
+		self.detector = detector
+		self.size = size
+		self.frames = OrderedDict()
+
+	@staticmethod
+	def key(header):
+		return (header.stamp.secs, header.stamp.nsecs, header.seq)
+
+	def lookup(self, header):
+		# (kp, des) of a frame already in the store, None otherwise
+		return self.frames.get(self.key(header))
+
+	def insert(self, header, kp, des):
+		key = self.key(header)
+		if key in self.frames:
+			del self.frames[key]
+		self.frames[key] = (kp, des)
+		while len(self.frames) > self.size:
+			self.frames.popitem(last=False)
+
+	def detect(self, header, frame):
+		# features of frame, running the detector only on a cache miss
+		features = self.lookup(header)
+		if features is None:
+			kp, des = self.detector.detectAndCompute(frame, None)
+			self.insert(header, kp, des)
+			features = (kp, des)
+		return features
+
+	def clear(self):
+		self.frames.clear()
@@ -0,0 +1,23 @@
+from autobebop.color_lut import ColorLUT
+
+# yellow of the gate, as an HSV box or a single Gaussian on HSV/255
+yellow_lower = (0, 80, 40) #lower threshhold values (H, S, V)
+yellow_upper = (80, 255, 250) #upper threshhold values (H, S, V)
+yellow_mu = [ 0.0889, 0.4376, 0.7321]
+yellow_sigma = [[0.0010, 0.0012, 0.0047],[0.0012, 0.0040, 0.0060],[0.0047, 0.0060, 0.0252]]
+yellow_P_thres = 2
+
+# topic of the colour mask gate_detect shares with gate_detect_cross (mono8, before morphology)
+mask_topic = '/gate_mask'
+
+def color_model(name='box', path=''):
+	# colour table of the gate yellow: trained offline (npz at path), 'gaussian' or 'box'
+	if path:
+		return ColorLUT.load(path)
+	if name == 'gaussian':
+		return ColorLUT.gaussian(yellow_mu, yellow_sigma, yellow_P_thres)
+	return ColorLUT.box(yellow_lower, yellow_upper)
+
+def segment(model, img, scale=1.0):
+	# 0/255 mask of the gate colour in the BGR image img, taken at scale of the full resolution
+	return model.segment(img, blur=max(1, int(round(5*scale))))
@@ -0,0 +1,119 @@
+import threading
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+# pixel type and channels of the sensor_msgs/Image encodings
+encodings = {
+	'mono8': (np.uint8, 1), '8UC1': (np.uint8, 1),
+	'bgr8': (np.uint8, 3), 'rgb8': (np.uint8, 3), '8UC3': (np.uint8, 3),
+	'bgra8': (np.uint8, 4), 'rgba8': (np.uint8, 4), '8UC4': (np.uint8, 4),
+	'mono16': (np.uint16, 1), '16UC1': (np.uint16, 1),
+}
+
+# conversions of the encodings that are not gray / BGR already
+to_gray = {
+	'bgr8': cv2.COLOR_BGR2GRAY, '8UC3': cv2.COLOR_BGR2GRAY, 'rgb8': cv2.COLOR_RGB2GRAY,
+	'bgra8': cv2.COLOR_BGRA2GRAY, '8UC4': cv2.COLOR_BGRA2GRAY, 'rgba8': cv2.COLOR_RGBA2GRAY,
+}
+to_bgr = {
+	'mono8': cv2.COLOR_GRAY2BGR, '8UC1': cv2.COLOR_GRAY2BGR, 'rgb8': cv2.COLOR_RGB2BGR,
+	'bgra8': cv2.COLOR_BGRA2BGR, '8UC4': cv2.COLOR_BGRA2BGR, 'rgba8': cv2.COLOR_RGBA2BGR,
+}
+
+def image_view(msg):
+	"""
+	Read-only array over the data of the sensor_msgs/Image msg in its own
+	encoding, without a copy (rows padded to msg.step stay strided)
+	"""
+	if msg.encoding not in encodings:
+		raise ValueError('unsupported image encoding ' + repr(msg.encoding))
+	dtype, channels = encodings[msg.encoding]
+	dtype = np.dtype(dtype).newbyteorder('>' if msg.is_bigendian else '<')
+	if isinstance(msg.data, (bytes, bytearray, memoryview)):
+		buf = np.frombuffer(msg.data, dtype=np.uint8)
+	else:
+		buf = np.asarray(msg.data, dtype=np.uint8)
+	rows = buf[:msg.height*msg.step].reshape(msg.height, msg.step)
+	img = rows[:,:msg.width*channels*dtype.itemsize].view(dtype)
+	if channels > 1:
+		img = img.reshape(msg.height, msg.width, channels)
+	img.flags.writeable = False
+	return img
+
+def to_full(geometry, level):
+	"""
+	Coordinates found at pyramid level in full resolution pixels: points,
+	contours, corners and (x, y, r) circles are all multiplied by 2**level
+	(pyrDown keeps the even pixels, so pixel x of a level is pixel 2x of the
+	one above)
+	"""
+	geometry = np.asarray(geometry, dtype=np.float64)
+	return geometry*(2**level) if level > 0 else geometry
+
+class ImageCache(object):
+	"""
+	Gray and BGR versions of the last few image messages and their pyramids
+
+	A mono8 message is its own gray image and a bgr8 one its own color image,
+	both read straight from the message buffer. The other version is
+	converted once per message and shared by every consumer, like the
+	previous left frame of the VO that was the left frame of the last pair.
+	Level k > 0 is level k-1 halved by pyrDown, built on the first request
+	and shared as well, so detectors working at different levels build the
+	pyramid once per frame (to_full maps their geometry back).
+	Entries are keyed by the message object (the left and right images of a
+	stereo pair share their header). All arrays are read-only, copy before
+	drawing on them.
+	"""
+
+	def __init__(self, size=4):
+		self.size = size
+		self.lock = threading.Lock()
+		self.entries = OrderedDict()
+
+	def entry(self, msg):
+		key = id(msg)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None or entry['msg'] is not msg:
+				# the message is held so its id is not reused while cached
+				entry = {'msg': msg, 'view': image_view(msg)}
+				self.entries[key] = entry
+				while len(self.entries) > self.size:
+					self.entries.popitem(last=False)
+			return entry
+
+	def level(self, entry, name, level, base):
+		# level of the gray / bgr pyramid of entry, base() makes level 0
+		key = (name, level)
+		if key not in entry:
+			if level == 0:
+				image = base()
+			else:
+				image = cv2.pyrDown(self.level(entry, name, level-1, base))
+			image.flags.writeable = False
+			entry[key] = image
+		return entry[key]
+
+	def gray(self, msg, level=0):
+		entry = self.entry(msg)
+		def base():
+			view = entry['view']
+			if view.ndim == 2:
+				return view
+			return cv2.cvtColor(view, to_gray[msg.encoding])
+		return self.level(entry, 'gray', level, base)
+
+	def color(self, msg, level=0):
+		entry = self.entry(msg)
+		def base():
+			view = entry['view']
+			if msg.encoding in to_bgr:
+				return cv2.cvtColor(view, to_bgr[msg.encoding])
+			return view
+		return self.level(entry, 'bgr', level, base)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
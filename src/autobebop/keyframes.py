@@ -0,0 +1,252 @@
+import threading, traceback
+import cv2
+import numpy as np
+import rospy
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
+from scipy.spatial.transform import Rotation as R
+from autobebop.matching import keypoint_coords, match_indices
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+class Keyframe(object):
+	"""
+	Left frame of a stereo pair kept as a reference for tracking
+
+	Only the left keypoints with a stereo match are kept, with their right
+	image x coordinate, and every one of them is the observation of a
+	landmark (ids). The pose is the camera to world rotation R_wc and the
+	camera position t_wc.
+	"""
+
+	def __init__(self, stamp, R_wc, t_wc, uv, uv_r, des, ids):
+		self.stamp = stamp
+		self.R_wc = R_wc
+		self.t_wc = t_wc
+		self.uv = uv
+		self.uv_r = uv_r
+		self.des = des
+		self.ids = ids
+
+class KeyframeMap(object):
+	"""
+	Keyframe based stereo VO
+
+	Every frame is located against the world landmarks seen by the current
+	keyframe with PnP. A new keyframe is inserted when the median parallax to
+	the current keyframe exceeds max_parallax pixels, or when fewer than
+	min_inliers PnP inliers are left (track loss). The last window keyframe
+	poses and the landmarks they share are refined by a small sparse
+	least squares (stereo reprojection error) on a background thread.
+	"""
+
+	def __init__(self, f, B, cx, cy, window=5, min_inliers=30, max_parallax=30.0, refine=True):
+		self.f = f
+		self.B = B
+		self.cx = cx
+		self.cy = cy
+		self.K = np.array([[f, 0.0, cx], [0.0, f, cy], [0.0, 0.0, 1.0]])
+		self.window = window
+		self.min_inliers = min_inliers
+		self.max_parallax = max_parallax
+
+		self.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+		self.lock = threading.Lock()
+		self.keyframes = []
+		self.landmarks = {}
+		self.next_id = 0
+
+		# matches of the last tracked frame against the current keyframe
+		self.last_match = None
+
+		self.requests = queue.Queue(maxsize=1)
+		if refine:
+			self.thread = threading.Thread(target=self.refine_loop)
+			self.thread.daemon = True
+			self.thread.start()
+
+	def track(self, kp, des, R_wc, t_wc):
+		"""
+		Pose of the frame with keypoints kp and descriptors des, with (R_wc, t_wc)
+		as the initial guess
+
+		Returns [R_wc, t_wc, num_inliers, parallax], or None without a keyframe
+		or when PnP fails
+		"""
+		self.last_match = None
+		with self.lock:
+			if not self.keyframes or des is None:
+				return None
+			kf = self.keyframes[-1]
+			obj = np.array([self.landmarks[i] for i in kf.ids])
+
+		matches = self.bf.match(des, kf.des)
+		if len(matches) < 6:
+			return None
+		q, t = match_indices(matches)
+		uv = keypoint_coords(kp)[q]
+
+		rvec, _ = cv2.Rodrigues(R_wc.T)
+		tvec = -np.dot(R_wc.T, t_wc)
+		ok, rvec, tvec, inliers = cv2.solvePnPRansac(obj[t].astype(np.float64), uv.astype(np.float64), self.K, None,
+			rvec.copy(), tvec.reshape(3,1).copy(), useExtrinsicGuess=True, iterationsCount=50, reprojectionError=2.0)
+		if not ok or inliers is None:
+			return None
+
+		inliers = inliers.ravel()
+		R_cw, _ = cv2.Rodrigues(rvec)
+		R_wc = R_cw.T
+		t_wc = -np.dot(R_wc, tvec.ravel())
+		parallax = np.median(np.linalg.norm(uv[inliers] - kf.uv[t[inliers]], axis=1))
+
+		self.last_match = (kf, q[inliers], t[inliers])
+		return [R_wc, t_wc, len(inliers), parallax]
+
+	def need_keyframe(self, num_inliers, parallax):
+		return num_inliers < self.min_inliers or parallax > self.max_parallax
+
+	def insert(self, stamp, R_wc, t_wc, kp, des, kp_r, matches_sp):
+		"""
+		Makes the frame a keyframe from its stereo matches (left kp to right kp_r)
+
+		Features matched to the previous keyframe by the last track() keep the
+		landmark they observe, the others start new landmarks from stereo depth
+		"""
+		q, t = match_indices(matches_sp)
+		if len(q) < 6:
+			return False
+		uv = keypoint_coords(kp)[q]
+		uv_r = keypoint_coords(kp_r)[t][:,0]
+		z = self.f*self.B/(uv_r - uv[:,0])
+		pts_c = np.column_stack(((uv[:,0] - self.cx)/self.f*z, (uv[:,1] - self.cy)/self.f*z, z))
+		pts_w = np.dot(pts_c, R_wc.T) + t_wc
+
+		ids = -np.ones(len(q), dtype=np.intp)
+		if self.last_match is not None:
+			kf_prev, q_prev, t_prev = self.last_match
+			# kp index -> landmark of the previous keyframe
+			lookup = -np.ones(len(kp), dtype=np.intp)
+			lookup[q_prev] = kf_prev.ids[t_prev]
+			ids = lookup[q]
+
+		with self.lock:
+			for i in np.flatnonzero(ids < 0):
+				ids[i] = self.next_id
+				self.landmarks[self.next_id] = pts_w[i]
+				self.next_id = self.next_id + 1
+			self.keyframes.append(Keyframe(stamp, R_wc, t_wc, uv, uv_r, des[q], ids))
+			if len(self.keyframes) > self.window:
+				self.keyframes.pop(0)
+				self.prune()
+
+		self.last_match = None
+		try:
+			self.requests.put_nowait(True)
+		except queue.Full:
+			pass
+		return True
+
+	def prune(self):
+		# drops the landmarks no keyframe of the window observes anymore
+		alive = set()
+		for kf in self.keyframes:
+			alive.update(kf.ids.tolist())
+		for i in list(self.landmarks.keys()):
+			if i not in alive:
+				del self.landmarks[i]
+
+	def refine_loop(self):
+		while True:
+			self.requests.get()
+			try:
+				self.refine()
+			except Exception:
+				rospy.logwarn('keyframe refinement failed\n' + traceback.format_exc())
+
+	def refine(self):
+		"""
+		Sliding window refinement of the keyframe poses (the oldest one is held
+		fixed) and of the landmarks seen by at least two of them
+		"""
+		with self.lock:
+			keyframes = list(self.keyframes)
+			landmarks = dict(self.landmarks)
+		if len(keyframes) < 2:
+			return
+
+		count = {}
+		for kf in keyframes:
+			for i in kf.ids:
+				count[i] = count.get(i, 0) + 1
+		lm_ids = sorted(i for i in count if count[i] >= 2 and i in landmarks)
+		if not lm_ids:
+			return
+		lm_index = dict((i, k) for k, i in enumerate(lm_ids))
+
+		# observations: keyframe, landmark, left u, v and right u
+		obs_kf = []
+		obs_lm = []
+		obs = []
+		for j, kf in enumerate(keyframes):
+			for k, i in enumerate(kf.ids):
+				if i in lm_index:
+					obs_kf.append(j)
+					obs_lm.append(lm_index[i])
+					obs.append((kf.uv[k,0], kf.uv[k,1], kf.uv_r[k]))
+		obs_kf = np.array(obs_kf)
+		obs_lm = np.array(obs_lm)
+		obs = np.array(obs)
+
+		num_kf = len(keyframes)
+		num_lm = len(lm_ids)
+		x0 = np.zeros(6*(num_kf-1) + 3*num_lm)
+		for j, kf in enumerate(keyframes[1:]):
+			x0[6*j:6*j+3] = R.from_dcm(kf.R_wc.T).as_rotvec()
+			x0[6*j+3:6*j+6] = -np.dot(kf.R_wc.T, kf.t_wc)
+		x0[6*(num_kf-1):] = np.array([landmarks[i] for i in lm_ids]).ravel()
+
+		R0 = keyframes[0].R_wc.T
+		t0 = -np.dot(R0, keyframes[0].t_wc)
+
+		def residuals(x):
+			R_cw = np.zeros((num_kf, 3, 3))
+			t_cw = np.zeros((num_kf, 3))
+			R_cw[0] = R0
+			t_cw[0] = t0
+			poses = x[:6*(num_kf-1)].reshape(-1, 6)
+			R_cw[1:] = R.from_rotvec(poses[:,:3]).as_dcm()
+			t_cw[1:] = poses[:,3:]
+			pts = x[6*(num_kf-1):].reshape(-1, 3)[obs_lm]
+			pc = np.einsum('nij,nj->ni', R_cw[obs_kf], pts) + t_cw[obs_kf]
+			z = np.maximum(pc[:,2], 1e-3)
+			u = self.f*pc[:,0]/z + self.cx
+			v = self.f*pc[:,1]/z + self.cy
+			u_r = u + self.f*self.B/z
+			return np.column_stack((u - obs[:,0], v - obs[:,1], u_r - obs[:,2])).ravel()
+
+		# every observation depends on its keyframe pose and its landmark only
+		sparsity = lil_matrix((3*len(obs), len(x0)), dtype=int)
+		rows = np.arange(len(obs))
+		for r in range(3):
+			for c in range(3):
+				sparsity[3*rows+r, 6*(num_kf-1) + 3*obs_lm + c] = 1
+			moving = obs_kf > 0
+			for c in range(6):
+				sparsity[3*rows[moving]+r, 6*(obs_kf[moving]-1) + c] = 1
+
+		sol = least_squares(residuals, x0, jac_sparsity=sparsity, method='trf', loss='huber', f_scale=2.0, max_nfev=20, x_scale='jac')
+		x = sol.x
+
+		with self.lock:
+			poses = x[:6*(num_kf-1)].reshape(-1, 6)
+			for j, kf in enumerate(keyframes[1:]):
+				R_cw = R.from_rotvec(poses[j,:3]).as_dcm()
+				kf.R_wc = R_cw.T
+				kf.t_wc = -np.dot(R_cw.T, poses[j,3:])
+			pts = x[6*(num_kf-1):].reshape(-1, 3)
+			for k, i in enumerate(lm_ids):
+				if i in self.landmarks:
+					self.landmarks[i] = pts[k]
@@ -0,0 +1,241 @@
+import cv2
+import numpy as np
+
+# number of set bits of every byte value, for Hamming distances of binary descriptors
+popcount = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+
+def match_indices(matches):
+	# queryIdx and trainIdx of a list of cv2.DMatch as int arrays
+	if len(matches) == 0:
+		return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+	idx = np.array([(m.queryIdx, m.trainIdx) for m in matches], dtype=np.intp)
+	return idx[:,0], idx[:,1]
+
+def keypoint_coords(kp):
+	# Nx2 float array of keypoint (x, y) image coordinates
+	if len(kp) == 0:
+		return np.zeros((0,2), np.float32)
+	return cv2.KeyPoint_convert(kp)
+
+def match_stereo(kp1, des1, kp2, des2, row_tol=1.0, min_disparity=1.0, max_disparity=64.0, max_distance=None):
+	"""
+	Cross checked descriptor matching between the left (kp1) and right (kp2)
+	keypoints of a rectified stereo pair
+
+	Right keypoints are sorted by row, and a left keypoint is only compared with
+	the right keypoints within row_tol rows whose disparity x2 - x1 lies in
+	(min_disparity, max_disparity]. Returns a list of cv2.DMatch like
+	cv2.BFMatcher.match(des1, des2) with crossCheck, only those with a Hamming
+	distance of at most max_distance when given
+	"""
+	if des1 is None or des2 is None or len(kp1) == 0 or len(kp2) == 0:
+		return []
+
+	X1 = keypoint_coords(kp1)
+	X2 = keypoint_coords(kp2)
+
+	# right keypoints bucketed by row
+	order = np.argsort(X2[:,1], kind='mergesort')
+	rows2 = X2[order,1]
+	starts = np.searchsorted(rows2, X1[:,1] - row_tol, side='left')
+	ends = np.searchsorted(rows2, X1[:,1] + row_tol, side='right')
+	counts = ends - starts
+	if counts.sum() == 0:
+		return []
+
+	# every (left, right) candidate pair inside the row band
+	li = np.repeat(np.arange(len(X1)), counts)
+	offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+	ri = order[np.repeat(starts, counts) + offset]
+
+	disparity = X2[ri,0] - X1[li,0]
+	keep = (np.abs(X2[ri,1] - X1[li,1]) < row_tol) & (disparity > min_disparity) & (disparity <= max_disparity)
+	li = li[keep]
+	ri = ri[keep]
+	if len(li) == 0:
+		return []
+
+	return cross_check(des1, des2, li, ri, max_distance)
+
+def cross_check(des1, des2, li, ri, max_distance=None):
+	"""
+	Mutual best matches among the candidate pairs (des1[li], des2[ri]), as a
+	list of cv2.DMatch, with a Hamming distance of at most max_distance when
+	given (no cutoff by default, like cv2.BFMatcher)
+	"""
+	if len(li) == 0:
+		return []
+	dist = popcount[np.bitwise_xor(des1[li], des2[ri])].sum(axis=1, dtype=np.int32)
+	if max_distance is not None:
+		keep = dist <= max_distance
+		li = li[keep]
+		ri = ri[keep]
+		dist = dist[keep]
+
+	# best des2 candidate of every des1 row and the other way round
+	best_right = -np.ones(len(des1), dtype=np.intp)
+	s = np.lexsort((dist, li))
+	_, first = np.unique(li[s], return_index=True)
+	best_right[li[s[first]]] = ri[s[first]]
+
+	best_left = -np.ones(len(des2), dtype=np.intp)
+	s = np.lexsort((dist, ri))
+	_, first = np.unique(ri[s], return_index=True)
+	best_left[ri[s[first]]] = li[s[first]]
+
+	matches = []
+	for k in np.flatnonzero((best_left[ri] == li) & (best_right[li] == ri)):
+		matches.append(cv2.DMatch(int(li[k]), int(ri[k]), float(dist[k])))
+	return matches
+
+def match_guided(kp1, des1, kp3, des3, pred, radius=15.0, max_distance=None):
+	"""
+	Cross checked matching of the current keypoints (kp1) with the previous
+	ones (kp3) where every current keypoint is only compared with the previous
+	keypoints within radius pixels of pred, its predicted position in the
+	previous frame (Nx2)
+
+	The previous keypoints are bucketed in a grid of radius sized cells, so
+	only the 3x3 cells around every prediction are visited. Returns a list of
+	cv2.DMatch like cv2.BFMatcher.match(des1, des3) with crossCheck, only those
+	with a Hamming distance of at most max_distance when given
+	"""
+	if des1 is None or des3 is None or len(kp1) == 0 or len(kp3) == 0:
+		return []
+
+	X3 = keypoint_coords(kp3)
+	pred = np.asarray(pred, dtype=np.float32).reshape(-1,2)
+
+	# previous keypoints sorted by grid cell
+	col3 = np.floor(X3[:,0]/radius).astype(np.intp)
+	row3 = np.floor(X3[:,1]/radius).astype(np.intp)
+	ncols = col3.max() + 1
+	cell3 = row3*ncols + col3
+	order = np.argsort(cell3, kind='mergesort')
+	cells_sorted = cell3[order]
+
+	col1 = np.floor(pred[:,0]/radius).astype(np.intp)
+	row1 = np.floor(pred[:,1]/radius).astype(np.intp)
+
+	li = []
+	ri = []
+	for dr in (-1, 0, 1):
+		for dc in (-1, 0, 1):
+			c = col1 + dc
+			r = row1 + dr
+			inside = (c >= 0) & (c < ncols) & (r >= 0)
+			cell = r*ncols + c
+			starts = np.searchsorted(cells_sorted, cell, side='left')
+			ends = np.searchsorted(cells_sorted, cell, side='right')
+			counts = np.where(inside, ends - starts, 0)
+			total = counts.sum()
+			if total == 0:
+				continue
+			li.append(np.repeat(np.arange(len(pred)), counts))
+			offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+			ri.append(order[np.repeat(starts, counts) + offset])
+	if not li:
+		return []
+	li = np.concatenate(li)
+	ri = np.concatenate(ri)
+
+	keep = np.sum((X3[ri] - pred[li])**2, axis=1) <= radius*radius
+	return cross_check(des1, des3, li[keep], ri[keep], max_distance)
+
+def predict_previous(X1, z, V, f, cx, cy, dt):
+	# positions in the previous frame of the current keypoints X1 at depth z, for the camera velocity V of the motion field
+	X1 = np.asarray(X1, dtype=np.float64).reshape(-1,2)
+	A = motion_field_rows((X1[:,0] - cx)/f, (X1[:,1] - cy)/f, z)
+	return X1 - f*dt*np.dot(A, V).reshape(-1,2)
+
+def match_temporal(kp1, des1, kp2, kp3, des3, matches_sp, V, f, B, cx, cy, dt, radius=15.0, max_distance=None):
+	"""
+	Guided temporal matching of the left keypoints kp1 with the previous left
+	keypoints kp3 for the last velocity estimate V
+
+	Keypoints with a stereo match (matches_sp with the right keypoints kp2)
+	use their own depth for the prediction, the others the median depth.
+	"""
+	X1 = keypoint_coords(kp1)
+	z = np.ones(len(X1))
+	q, t = match_indices(matches_sp)
+	if len(q):
+		disparity = keypoint_coords(kp2)[t,0] - X1[q,0]
+		good = disparity > 1
+		if np.any(good):
+			z = z*np.median(f*B/disparity[good])
+			z[q[good]] = f*B/disparity[good]
+	return match_guided(kp1, des1, kp3, des3, predict_previous(X1, z, V, f, cx, cy, dt), radius, max_distance)
+
+def three_view_correspondences(kp1, kp2, kp3, matches_sp, matches_tm):
+	"""
+	Joins the spatial (left -> right) and temporal (left -> previous left)
+	matches on the left keypoint index
+
+	Returns the Mx2 coordinate arrays [X1, X2, X3] of the left, right and
+	previous left keypoints of every left keypoint matched in both lists
+	"""
+	q_sp, t_sp = match_indices(matches_sp)
+	q_tm, t_tm = match_indices(matches_tm)
+
+	# lookup table from left keypoint to previous left keypoint, -1 when unmatched
+	lookup = -np.ones(len(kp1), dtype=np.intp)
+	lookup[q_tm] = t_tm
+	t3 = lookup[q_sp]
+	joined = t3 >= 0
+
+	X1 = keypoint_coords(kp1)[q_sp[joined]]
+	X2 = keypoint_coords(kp2)[t_sp[joined]]
+	X3 = keypoint_coords(kp3)[t3[joined]]
+	return [X1, X2, X3]
+
+def motion_field(X1, X2, X3, f, B, cx, cy, dt):
+	"""
+	Depth from the rectified stereo pair and image motion between the previous
+	and current left frame for every three-view correspondence
+
+	Only rows with abs(y1-y2) < 1 and a disparity above one pixel are kept.
+	Returns [valid, x, y, z, vx_img, vy_img, A, Y] where valid masks the input
+	rows, x, y are normalized image coordinates and A, Y hold the interleaved
+	f1, f2 rows of the motion field A*V = Y of the valid rows
+	"""
+	X1 = np.asarray(X1, dtype=np.float64).reshape(-1,2)
+	X2 = np.asarray(X2, dtype=np.float64).reshape(-1,2)
+	X3 = np.asarray(X3, dtype=np.float64).reshape(-1,2)
+
+	disparity = X2[:,0] - X1[:,0]
+	valid = (np.abs(X1[:,1] - X2[:,1]) < 1) & (disparity > 1)
+
+	x1 = X1[valid,0]
+	y1 = X1[valid,1]
+	z = (f*B)/disparity[valid]
+
+	vx_img = (x1 - X3[valid,0])/(f*dt)
+	vy_img = (y1 - X3[valid,1])/(f*dt)
+
+	x = (x1 - cx)/f
+	y = (y1 - cy)/f
+
+	A = motion_field_rows(x, y, z)
+
+	Y = np.zeros(2*len(z))
+	Y[0::2] = vx_img
+	Y[1::2] = vy_img
+
+	return [valid, x, y, z, vx_img, vy_img, A, Y]
+
+def motion_field_rows(x, y, z):
+	# interleaved f1, f2 rows of the motion field of the normalized points x, y at depth z
+	n = len(z)
+	A = np.zeros((2*n, 6))
+	A[0::2,0] = -1.0/z
+	A[0::2,2] = x/z
+	A[0::2,3] = x*y
+	A[0::2,4] = -(1.0+x*x)
+	A[0::2,5] = y
+	A[1::2,1] = -1.0/z
+	A[1::2,2] = y/z
+	A[1::2,3] = 1.0+y*y
+	A[1::2,4] = -x*y
+	A[1::2,5] = -x
+	return A
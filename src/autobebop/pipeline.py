@@ -0,0 +1,93 @@
+import threading, time, traceback
+from multiprocessing.pool import ThreadPool
+import rospy
+
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+class StereoPipeline(object):
+	"""
+	Pipelined feature extraction for the stereo VO
+
+	A feeder thread takes the next item from source (StereoSync.wait, which
+	already keeps only the newest pair), turns it into frames with prepare
+	and runs extract_left and extract_right on them in parallel on a thread
+	pool (OpenCV releases the GIL). The results wait in a bounded queue that
+	drops the oldest frame when full, so get() always hands out the newest
+	extracted frame while the next one is being extracted.
+
+	extract_left and extract_right must not share detector instances, they
+	run at the same time. A frame whose prepare or extraction raises is
+	skipped and logged (with the traceback at most every warn_period
+	seconds), dropped and failed frames are counted (dropped, errors) and
+	reported through the profiler when one is given.
+	"""
+
+	def __init__(self, source, prepare, extract_left, extract_right, workers=2, queue_size=1, profiler=None, warn_period=5.0):
+		self.source = source
+		self.prepare = prepare
+		self.extract_left = extract_left
+		self.extract_right = extract_right
+		self.pool = ThreadPool(workers)
+		self.out = queue.Queue(maxsize=queue_size)
+		self.profiler = profiler
+		self.dropped = 0
+		self.errors = 0
+		self.warn_period = warn_period
+		self.warned = None
+		self.running = True
+		self.thread = threading.Thread(target=self.feed)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def feed(self):
+		while self.running:
+			item = self.source(0.1)
+			if item is None:
+				continue
+			try:
+				frames = self.prepare(item)
+				if frames is None:
+					continue
+				left = self.pool.apply_async(self.extract_left, (frames,))
+				right = self.pool.apply_async(self.extract_right, (frames,))
+				result = (item, frames, left.get(), right.get())
+			except Exception:
+				self.errors = self.errors + 1
+				if self.profiler is not None:
+					self.profiler.count('pipeline errors')
+				# throttled here, rospy's throttled loggers need init_node (not called under VO_replay)
+				now = time.time()
+				if self.warned is None or now - self.warned >= self.warn_period:
+					self.warned = now
+					rospy.logwarn('stereo pipeline: frame skipped (%d so far)\n%s' % (self.errors, traceback.format_exc()))
+				continue
+			self.put(result)
+
+	def put(self, result):
+		while True:
+			try:
+				self.out.put_nowait(result)
+				return
+			except queue.Full:
+				# the consumer is behind, the oldest frame is stale
+				try:
+					self.out.get_nowait()
+					self.dropped = self.dropped + 1
+					if self.profiler is not None:
+						self.profiler.count('pipeline dropped')
+				except queue.Empty:
+					pass
+
+	def get(self, timeout=None):
+		# [item, frames, left features, right features] of the newest frame, None on timeout
+		try:
+			return list(self.out.get(True, timeout))
+		except queue.Empty:
+			return None
+
+	def stop(self):
+		self.running = False
+		self.pool.close()
@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+# closed form planar solver with both solutions (OpenCV >= 4.1), before that (OpenCV 3)
+# both solutions are seeded from the homography of the plane (homography_poses)
+ippe = getattr(cv2, 'SOLVEPNP_IPPE', None)
+
+def reprojection_error(model, pts, rvec, tvec, K, D):
+	# RMS distance (pixels) between the pixels pts and the projected model points
+	proj, _ = cv2.projectPoints(model, rvec, tvec, K, D)
+	return np.sqrt(np.mean(np.sum((proj.reshape(-1,2) - pts.reshape(-1,2))**2, axis=1)))
+
+def rotation_change(r0, r1):
+	# angle (rad) of the rotation between the rotation vectors r0 and r1
+	R0, _ = cv2.Rodrigues(np.asarray(r0, dtype=np.float64))
+	R1, _ = cv2.Rodrigues(np.asarray(r1, dtype=np.float64))
+	return np.arccos(np.clip((np.trace(np.dot(R0.T, R1)) - 1.0)/2.0, -1.0, 1.0))
+
+def homography_poses(model, pts, K, D):
+	"""
+	The two poses [[rvec, tvec], ...] of the planar model (Nx3, z=0) seen at
+	the pixels pts that a planar target is ambiguous between
+
+	The first one is decomposed from the homography of the model plane to
+	the undistorted normalized pixels. The second one mirrors the plane
+	normal about the line of sight to the model centre, which is the flip
+	a small or far target can not tell apart.
+	"""
+	x = cv2.undistortPoints(pts.reshape(-1,1,2), K, D).reshape(-1,2)
+	H, _ = cv2.findHomography(model[:,:2], x, 0)
+	if H is None:
+		return []
+	# H ~ [r1 r2 t], scaled by the mean norm of r1 and r2, in front of the camera
+	H = H/(0.5*(np.linalg.norm(H[:,0]) + np.linalg.norm(H[:,1])))
+	if H[2,2] < 0:
+		H = -H
+	Rm = np.column_stack((H[:,0], H[:,1], np.cross(H[:,0], H[:,1])))
+	U, _, Vt = np.linalg.svd(Rm)
+	R = np.dot(U, Vt)
+	if np.linalg.det(R) < 0:
+		R = np.dot(U*[1.0, 1.0, -1.0], Vt)
+	t = H[:,2]
+
+	# centre of the model and its line of sight, the mirrored normal keeps the centre in place
+	c = model.mean(axis=0)
+	p = t + np.dot(R, c)
+	v = p/np.linalg.norm(p)
+	n = R[:,2]
+	n2 = 2.0*np.dot(n, v)*v - n
+	axis = np.cross(n, n2)
+	s = np.linalg.norm(axis)
+	rot = np.zeros(3)
+	if s > 1e-12:
+		rot = axis/s*np.arctan2(s, np.dot(n, n2))
+	R2 = np.dot(cv2.Rodrigues(rot)[0], R)
+	t2 = p - np.dot(R2, c)
+	return [[cv2.Rodrigues(R)[0], t.reshape(3,1)], [cv2.Rodrigues(R2)[0], t2.reshape(3,1)]]
+
+def solve(model, pts, K, D, guess=None, max_error=4.0):
+	"""
+	Pose [rvec, tvec, RMS reprojection error] of the planar model (Nx3, z=0)
+	seen at the pixels pts (Nx2)
+
+	With a guess (rvec, tvec), like the pose of the previous frame, the
+	iterative solver starts from it and its result is kept when it
+	reprojects within max_error pixels. Otherwise the two planar solutions
+	are computed from scratch (IPPE, or the homography seeds refined by the
+	iterative solver on OpenCV 3) and the one closest to the guess among
+	those within max_error (the lowest error without a guess) is kept.
+	"""
+	model = np.ascontiguousarray(model, dtype=np.float64).reshape(-1,3)
+	pts = np.ascontiguousarray(pts, dtype=np.float64).reshape(-1,2)
+	if guess is not None:
+		rvec = np.array(guess[0], dtype=np.float64).reshape(3,1)
+		tvec = np.array(guess[1], dtype=np.float64).reshape(3,1)
+		ok, rvec, tvec = cv2.solvePnP(model, pts, K, D, rvec, tvec, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+		if ok:
+			err = reprojection_error(model, pts, rvec, tvec, K, D)
+			if err <= max_error:
+				return [rvec, tvec, err]
+
+	if ippe is None:
+		rvecs = []
+		tvecs = []
+		for rvec, tvec in homography_poses(model, pts, K, D):
+			ok, rvec, tvec = cv2.solvePnP(model, pts, K, D, rvec, tvec, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+			if ok:
+				rvecs.append(rvec)
+				tvecs.append(tvec)
+		if not rvecs:
+			ok, rvec, tvec = cv2.solvePnP(model, pts, K, D, flags=cv2.SOLVEPNP_ITERATIVE)
+			rvecs.append(rvec)
+			tvecs.append(tvec)
+		errs = [reprojection_error(model, pts, rvecs[i], tvecs[i], K, D) for i in range(len(rvecs))]
+		best = pick(errs, rvecs, guess, max_error)
+		return [rvecs[best], tvecs[best], errs[best]]
+
+	n, rvecs, tvecs, errs = cv2.solvePnPGeneric(model, pts, K, D, flags=ippe)
+	best = pick(np.asarray(errs).ravel(), rvecs, guess, max_error)
+	rvec, tvec = cv2.solvePnPRefineLM(model, pts, K, D, rvecs[best].copy(), tvecs[best].copy())
+	return [rvec, tvec, reprojection_error(model, pts, rvec, tvec, K, D)]
+
+def pick(errs, rvecs, guess, max_error):
+	# index of the solution closest to the guess among those within max_error, else the lowest error
+	best = int(np.argmin(errs))
+	if guess is not None:
+		near = [i for i in range(len(errs)) if errs[i] <= max_error]
+		if near:
+			best = min(near, key=lambda i: rotation_change(guess[0], rvecs[i]))
+	return best
+
+def covariance(model, pts, rvec, tvec, K, D, sigma=1.0):
+	"""
+	6x6 covariance of (tvec, rvec) from the projection Jacobian, for pixel
+	noise sigma or the reprojection residuals if they are larger
+	"""
+	model = np.ascontiguousarray(model, dtype=np.float64).reshape(-1,3)
+	proj, J = cv2.projectPoints(model, rvec, tvec, K, D)
+	J = np.hstack((J[:,3:6], J[:,0:3]))
+	res = proj.reshape(-1) - np.asarray(pts, dtype=np.float64).reshape(-1)
+	dof = max(1, len(res) - 6)
+	s2 = max(sigma**2, np.dot(res, res)/dof)
+	return s2*np.linalg.pinv(np.dot(J.T, J))
@@ -0,0 +1,113 @@
+import threading
+import numpy as np
+from collections import deque
+from autobebop.attitude import integrate_attitude, quat_conjugate, quat_exp, quat_log, quat_multiply, quat_to_dcm
+
+def skew(v):
+	return np.array([[0.0, -v[2], v[1]], [v[2], 0.0, -v[0]], [-v[1], v[0], 0.0]])
+
+class Preintegrator(object):
+	"""
+	Buffers high rate inertial samples and integrates them between two image
+	stamps into the body frame increments of rotation and velocity
+
+	Samples are body rates (and specific forces) held constant until the next
+	sample. They come from sensor_msgs/Imu with add_imu, or from a stream of
+	attitudes (the Bebop odom orientation) with add_orientation, which turns
+	consecutive orientations into body rates and carries no acceleration, so
+	its velocity increment stays zero.
+
+	The last rate is held for at most one sample period past the time it is
+	known up to (end), an interval has to be covered up to there.
+
+	gyro_noise and accel_noise are the white noise densities (rad/s/sqrt(Hz),
+	m/s^2/sqrt(Hz)) the increment covariance is propagated with.
+	"""
+
+	def __init__(self, size=1000, gyro_noise=0.01, accel_noise=0.1):
+		self.gyro_noise = gyro_noise
+		self.accel_noise = accel_noise
+		self.lock = threading.Lock()
+		self.samples = deque(maxlen=size)
+		self.last_orientation = None
+		self.end = None
+
+	def add(self, t, omega, accel, known):
+		# sample starting at t whose rate is known up to the time known
+		with self.lock:
+			period = t - self.samples[-1][0] if self.samples else 0.0
+			self.samples.append((t, np.asarray(omega, dtype=np.float64), np.asarray(accel, dtype=np.float64)))
+			self.end = known + max(period, known - t)
+
+	def add_imu(self, t, omega, accel):
+		self.add(t, omega, accel, t)
+
+	def add_orientation(self, t, quat):
+		# body to inertial attitude [x, y, z, w] at time t
+		quat = np.array(quat, dtype=np.float64)
+		prev = self.last_orientation
+		self.last_orientation = (t, quat)
+		if prev is None or t <= prev[0]:
+			return
+		# R_prev^T * R, the rotation from the previous body frame to this one
+		omega = quat_log(quat_multiply(quat_conjugate(prev[1]), quat))/(t - prev[0])
+		self.add(prev[0], omega, np.zeros(3), t)
+
+	def integrate(self, t0, t1):
+		"""
+		Increments between t0 and t1 (t0 < t1)
+
+		Returns [dq, dv, cov] with dq the rotation [x, y, z, w] from the body
+		frame at t1 to the one at t0 (R_b0_b1), dv the velocity change in the
+		t0 body frame without gravity and cov the 6x6 covariance of the
+		rotation error (rotation vector) and dv, or None when the samples do
+		not cover the interval
+		"""
+		with self.lock:
+			samples = list(self.samples)
+			end = self.end
+		if not samples or t1 <= t0:
+			return None
+		ts = np.array([s[0] for s in samples])
+		if ts[0] > t0 or end < t1 - 0.1*(t1 - t0):
+			return None
+
+		# pieces of the constant sample intervals that fall inside [t0, t1]
+		first = max(np.searchsorted(ts, t0, side='right') - 1, 0)
+		last = np.searchsorted(ts, t1, side='left')
+		idx = np.arange(first, last)
+		bounds = np.clip(np.append(ts[idx], t1), t0, t1)
+		dts = np.diff(bounds)
+		W = np.array([samples[i][1] for i in idx])
+		Acc = np.array([samples[i][2] for i in idx])
+
+		# R_bk_b0 = exp(-w*dt)*R_b(k-1)_b0, inverted to get R_b0_bk
+		q_k = quat_conjugate(integrate_attitude(np.array([0.0, 0.0, 0.0, 1.0]), -W, dts))
+
+		dv = np.zeros(3)
+		cov = np.zeros((6,6))
+		Rk = np.eye(3)
+		Qg = self.gyro_noise**2
+		Qa = self.accel_noise**2
+		for k in range(len(dts)):
+			dt = dts[k]
+			dR = quat_to_dcm(quat_exp(W[k]*dt))
+			F = np.eye(6)
+			F[:3,:3] = dR.T
+			F[3:,:3] = -np.dot(Rk, skew(Acc[k]))*dt
+			G = np.zeros((6,6))
+			G[:3,:3] = np.eye(3)*dt
+			G[3:,3:] = Rk*dt
+			# discrete noise of the densities over dt
+			Q = np.concatenate((Qg*np.ones(3), Qa*np.ones(3)))/max(dt, 1e-9)
+			cov = np.dot(np.dot(F, cov), F.T) + np.dot(G*Q, G.T)
+			dv = dv + np.dot(Rk, Acc[k])*dt
+			Rk = quat_to_dcm(q_k[k])
+
+		return [q_k[-1], dv, cov]
+
+	def clear(self, t):
+		# drops the samples that ended before t
+		with self.lock:
+			while len(self.samples) > 1 and self.samples[1][0] <= t:
+				self.samples.popleft()
@@ -0,0 +1,150 @@
+import functools, threading, time
+import numpy as np
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+class Stage(object):
+	"""
+	Ring buffer of the last size latencies (seconds) of one stage, usable as a
+	context manager around the stage. A stage is timed from one thread at a
+	time, different stages may run on different threads.
+	"""
+
+	def __init__(self, size):
+		self.times = np.zeros(size)
+		self.count = 0
+		self.t = 0.0
+
+	def add(self, dt):
+		self.times[self.count % len(self.times)] = dt
+		self.count = self.count + 1
+
+	def __enter__(self):
+		self.t = time.time()
+		return self
+
+	def __exit__(self, *exc):
+		self.add(time.time() - self.t)
+		return False
+
+	def percentiles(self, q=(50, 95, 99)):
+		# latencies (seconds) at the percentiles q of the buffered calls, None before the first call
+		n = min(self.count, len(self.times))
+		if n == 0:
+			return None
+		return np.percentile(self.times[:n], q)
+
+class NullStage(object):
+	# stand-in for a Stage while profiling is disabled
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+null_stage = NullStage()
+
+class Profiler(object):
+	"""
+	Per-stage latency histograms and frame drop counts of a node
+
+	Stages are timed with the timed(name) decorator, the stage(name) context
+	manager or record(name, dt). frame(header) counts the input frames the
+	node skipped (gaps in header.seq) or processed again (same seq). Disabled
+	(the default) every hook returns right away, start() enables it and
+	publishes the p50/p95/p99 of every stage and the frame counts as a
+	diagnostic_msgs/DiagnosticArray every period seconds.
+	"""
+
+	def __init__(self, name, size=256):
+		self.name = name
+		self.size = size
+		self.enabled = False
+		self.lock = threading.Lock()
+		self.stages = {}
+		self.frames = 0
+		self.dropped = 0
+		self.repeated = 0
+		self.counts = {}
+		self.last_seq = None
+		self.pub = None
+		self.timer = None
+
+	def get(self, name):
+		stage = self.stages.get(name)
+		if stage is None:
+			with self.lock:
+				stage = self.stages.setdefault(name, Stage(self.size))
+		return stage
+
+	def stage(self, name):
+		if not self.enabled:
+			return null_stage
+		return self.get(name)
+
+	def record(self, name, dt):
+		if self.enabled:
+			self.get(name).add(dt)
+
+	def timed(self, name):
+		def decorator(fn):
+			@functools.wraps(fn)
+			def wrapper(*args, **kwargs):
+				if not self.enabled:
+					return fn(*args, **kwargs)
+				t = time.time()
+				try:
+					return fn(*args, **kwargs)
+				finally:
+					self.get(name).add(time.time() - t)
+			return wrapper
+		return decorator
+
+	def count(self, name, n=1):
+		# event counter (dropped or failed frames of a stage) reported next to the frame counts
+		if self.enabled:
+			with self.lock:
+				self.counts[name] = self.counts.get(name, 0) + n
+
+	def frame(self, header):
+		if not self.enabled:
+			return
+		seq = header.seq
+		if self.last_seq is not None:
+			if seq == self.last_seq:
+				self.repeated = self.repeated + 1
+			elif seq > self.last_seq + 1:
+				self.dropped = self.dropped + seq - self.last_seq - 1
+		self.last_seq = seq
+		self.frames = self.frames + 1
+
+	def start(self, period=5.0, topic='/diagnostics'):
+		self.enabled = True
+		self.pub = rospy.Publisher(topic, DiagnosticArray, queue_size=1)
+		self.timer = rospy.Timer(rospy.Duration(period), self.publish)
+
+	def status(self):
+		status = DiagnosticStatus()
+		status.level = DiagnosticStatus.OK
+		status.name = self.name + ': latency'
+		status.hardware_id = self.name
+		status.message = '%d frames, %d dropped, %d repeated' % (self.frames, self.dropped, self.repeated)
+		status.values = [KeyValue('frames', str(self.frames)), KeyValue('dropped', str(self.dropped)),
+			KeyValue('repeated', str(self.repeated))]
+		for name in sorted(self.counts.keys()):
+			status.values.append(KeyValue(name, str(self.counts[name])))
+		for name in sorted(self.stages.keys()):
+			p = self.stages[name].percentiles()
+			if p is None:
+				continue
+			status.values.append(KeyValue(name + ' calls', str(self.stages[name].count)))
+			for q, value in zip(('p50', 'p95', 'p99'), p):
+				status.values.append(KeyValue('%s %s [ms]' % (name, q), '%.2f' % (1000.0*value)))
+		return status
+
+	def publish(self, event=None):
+		msg = DiagnosticArray()
+		msg.header.stamp = rospy.Time.now()
+		msg.status = [self.status()]
+		self.pub.publish(msg)
@@ -0,0 +1,157 @@
+import numpy as np
+from math import log, ceil
+
+# hypotheses are drawn and scored in blocks of this size so that the early stop can kick in
+batch_size = 32
+
+def required_iterations(inlier_ratio, min_pts, confidence):
+	"""
+	Number of RANSAC draws needed to pick at least one all-inlier sample
+	with the given confidence, for the current best inlier ratio
+	"""
+	p_good = inlier_ratio**min_pts
+	if (p_good <= 0.0):
+		return float('inf')
+	if (p_good >= 1.0):
+		return 0
+	return int(ceil(log(1.0-confidence)/log(1.0-p_good)))
+
+def draw_samples(num_pts, min_pts, num_draws):
+	# every row holds min_pts distinct point indices
+	idx = np.random.randint(0, num_pts, size=(num_draws, min_pts))
+	distinct = np.ones(num_draws, dtype=bool)
+	for i in range(min_pts):
+		for j in range(i+1, min_pts):
+			distinct &= idx[:,i] != idx[:,j]
+	return idx[distinct]
+
+def solve_batch(M, b, eps=1e-9):
+	# solves the stack of square systems M[k] x = b[k], dropping the (near) singular ones
+	good = np.abs(np.linalg.det(M)) > eps
+	if not np.any(good):
+		return np.zeros((0, M.shape[2])), good
+	x = np.linalg.solve(M[good], b[good][..., np.newaxis])[..., 0]
+	return x, good
+
+def ransac_plane(data, itern, threshDist, stop_ratio=0.9, confidence=0.99):
+	"""
+	Fits the plane a*X + b*Y + c*Z = -1 to the Nx3 points in data
+
+	All minimal samples of a block are solved together and scored against
+	the whole cloud with one matrix product. Stops after itern hypotheses,
+	once the best inlier ratio reaches stop_ratio, or once the adaptive
+	iteration count for the given confidence is reached.
+
+	Returns [P, res, inlier_no, inliers] where P is the 3x1 plane refit on the
+	inliers of the best hypothesis and inliers is the boolean mask over data
+	"""
+	data = np.asarray(data, dtype=np.float64)
+	num_pts = data.shape[0]
+	min_pts = 3
+
+	best_inlier_num = 0
+	best_inliers = np.zeros(num_pts, dtype=bool)
+	if (num_pts < min_pts):
+		return [np.zeros((3,1)), np.zeros(0), 0, best_inliers]
+
+	max_itern = itern
+	done = 0
+	while (done < max_itern):
+		num_draws = min(batch_size, max_itern - done)
+		done = done + num_draws
+
+		idx = draw_samples(num_pts, min_pts, num_draws)
+		if (len(idx) == 0):
+			continue
+		P, good = solve_batch(data[idx], -np.ones((len(idx), min_pts)))
+		if (len(P) == 0):
+			continue
+
+		# point to plane distance of every point against every hypothesis
+		dist = np.abs(np.dot(data, P.T) + 1.0)/np.linalg.norm(P, axis=1)
+		inliers = dist <= threshDist
+		inlier_num = inliers.sum(axis=0)
+
+		k = np.argmax(inlier_num)
+		if (inlier_num[k] > best_inlier_num):
+			best_inlier_num = inlier_num[k]
+			best_inliers = inliers[:,k]
+
+			inlier_ratio = best_inlier_num*1.0/num_pts
+			if (inlier_ratio >= stop_ratio):
+				break
+			max_itern = min(itern, required_iterations(inlier_ratio, min_pts, confidence))
+
+	if (best_inlier_num < min_pts):
+		return [np.zeros((3,1)), np.zeros(0), best_inlier_num, best_inliers]
+
+	A = data[best_inliers]
+	b = -np.ones((len(A),1))
+	x,res,_,_ = np.linalg.lstsq(A,b, rcond=None)
+	return [x, res, best_inlier_num, best_inliers]
+
+def ransac_motion(A, Y, itern, threshDist, min_pts=3, stop_ratio=0.9, confidence=0.99):
+	"""
+	Robust solve of the motion field A*V = Y for the 6-DoF camera velocity V
+
+	A holds the interleaved (f1, f2) rows of every feature and Y the matching
+	(vx_img, vy_img) entries, so A is viewed as an (N, 2, 6) tensor and a point
+	is an inlier when the 2-norm of its residual block is below threshDist.
+	Hypotheses are solved in batches from min_pts points each (2*min_pts rows).
+
+	Returns [V, res, inlier_no, inliers] where V is refit on the inliers of the
+	best hypothesis and inliers is the boolean mask over the N features
+	"""
+	num_param = A.shape[1]
+	A_blk = np.reshape(np.asarray(A, dtype=np.float64), (-1, 2, num_param))
+	Y_blk = np.reshape(np.asarray(Y, dtype=np.float64), (-1, 2))
+	num_pts = A_blk.shape[0]
+
+	best_inlier_num = 0
+	best_inliers = np.zeros(num_pts, dtype=bool)
+	if (num_pts < min_pts):
+		return [np.zeros(num_param), 0, 0, best_inliers]
+
+	max_itern = itern
+	done = 0
+	while (done < max_itern):
+		num_draws = min(batch_size, max_itern - done)
+		done = done + num_draws
+
+		idx = draw_samples(num_pts, min_pts, num_draws)
+		if (len(idx) == 0):
+			continue
+		M = np.reshape(A_blk[idx], (len(idx), 2*min_pts, num_param))
+		b = np.reshape(Y_blk[idx], (len(idx), 2*min_pts))
+		if (2*min_pts == num_param):
+			V, good = solve_batch(M, b)
+		else:
+			# over determined samples, solve their normal equations
+			Mt = np.transpose(M, (0, 2, 1))
+			V, good = solve_batch(np.matmul(Mt, M), np.einsum('kij,kj->ki', Mt, b))
+		if (len(V) == 0):
+			continue
+
+		# residual block of every point against every hypothesis
+		err = np.einsum('nij,kj->kni', A_blk, V) - Y_blk
+		dist = np.sqrt(np.sum(err*err, axis=2))
+		inliers = dist <= threshDist
+		inlier_num = inliers.sum(axis=1)
+
+		k = np.argmax(inlier_num)
+		if (inlier_num[k] > best_inlier_num):
+			best_inlier_num = inlier_num[k]
+			best_inliers = inliers[k]
+
+			inlier_ratio = best_inlier_num*1.0/num_pts
+			if (inlier_ratio >= stop_ratio):
+				break
+			max_itern = min(itern, required_iterations(inlier_ratio, min_pts, confidence))
+
+	if (best_inlier_num < min_pts):
+		return [np.zeros(num_param), 0, best_inlier_num, best_inliers]
+
+	A_in = np.reshape(A_blk[best_inliers], (-1, num_param))
+	Y_in = np.reshape(Y_blk[best_inliers], (-1,))
+	x,res,_,_ = np.linalg.lstsq(A_in, Y_in, rcond=None)
+	return [x, res, best_inlier_num, best_inliers]
@@ -0,0 +1,56 @@
+import numpy as np
+
+def normal_equations(A, Y, w=None):
+	# A^T W A and A^T W Y of the weighted least squares problem A*V = Y
+	if w is None:
+		return np.dot(A.T, A), np.dot(A.T, Y)
+	Aw = A*w[:,np.newaxis]
+	return np.dot(Aw.T, A), np.dot(Aw.T, Y)
+
+def robust_weights(r, sigma, loss='huber'):
+	# IRLS weights of the residual norms r for the Huber or Cauchy loss
+	if (loss == 'cauchy'):
+		c = 2.3849*sigma
+		return 1.0/(1.0 + (r/c)**2)
+	k = 1.345*sigma
+	w = np.ones(len(r))
+	big = r > k
+	w[big] = k/r[big]
+	return w
+
+def solve_irls(A, Y, itern=5, loss='huber', block=2, min_sigma=1e-6):
+	"""
+	Robust solve of A*V = Y by iteratively reweighted least squares
+
+	The rows of A come in blocks of block rows per feature (the f1, f2 rows of
+	the motion field), each feature gets one weight from the norm of its
+	residual block. The residual scale is re-estimated every iteration from
+	the median absolute deviation.
+
+	Returns [V, cov, w] with V the estimate, cov its covariance and w the final
+	feature weights, or [None, None, None] if the system is not solvable
+	"""
+	A = np.asarray(A, dtype=np.float64)
+	Y = np.asarray(Y, dtype=np.float64)
+	num_param = A.shape[1]
+	num_pts = A.shape[0]//block
+	if (num_pts*block <= num_param):
+		return [None, None, None]
+
+	w = np.ones(num_pts)
+	for i in range(itern+1):
+		AtA, AtY = normal_equations(A, Y, np.repeat(w, block))
+		try:
+			V = np.linalg.solve(AtA, AtY)
+		except np.linalg.LinAlgError:
+			return [None, None, None]
+
+		r = np.sqrt(np.sum(np.reshape(np.dot(A, V) - Y, (num_pts, block))**2, axis=1))
+		sigma = max(1.4826*np.median(r), min_sigma)
+		if (i < itern):
+			w = robust_weights(r, sigma, loss)
+
+	# robust (MAD) variance of the residual rows scales the inverse information matrix
+	s = max(1.4826*np.median(np.abs(np.dot(A, V) - Y)), min_sigma)
+	cov = s*s*np.linalg.inv(AtA)
+	return [V, cov, w]
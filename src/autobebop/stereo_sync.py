@@ -0,0 +1,49 @@
+import threading
+import message_filters
+from sensor_msgs.msg import Image
+
+class StereoSync(object):
+	"""
+	Approximate time synchronization of the left and right image topics
+
+	Every matched pair wakes up wait() once, so the consumer runs once per
+	new stereo pair and never on a stale or mismatched one. The time step
+	between consecutive left frames comes from the header stamps.
+	"""
+
+	def __init__(self, left_topic, right_topic, queue_size=5, slop=0.01):
+		self.lock = threading.Lock()
+		self.event = threading.Event()
+		self.left = None
+		self.right = None
+		self.left_prev = None
+		self.dt = 0.0
+
+		self.sub_left = message_filters.Subscriber(left_topic, Image)
+		self.sub_right = message_filters.Subscriber(right_topic, Image)
+		self.sync = message_filters.ApproximateTimeSynchronizer([self.sub_left, self.sub_right], queue_size, slop)
+		self.sync.registerCallback(self.callback)
+
+	def callback(self, left, right):
+		with self.lock:
+			if self.left is not None:
+				self.dt = (left.header.stamp - self.left.header.stamp).to_sec()
+			self.left_prev = self.left
+			self.left = left
+			self.right = right
+		self.event.set()
+
+	def wait(self, timeout=None):
+		"""
+		Blocks until a new pair arrived (or timeout)
+
+		Returns [left, right, left_prev, dt], or None when no new pair with a
+		previous left frame is available
+		"""
+		if not self.event.wait(timeout):
+			return None
+		with self.lock:
+			self.event.clear()
+			if self.left_prev is None:
+				return None
+			return [self.left, self.right, self.left_prev, self.dt]
@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+from autobebop.feature_store import FeatureStore
+from autobebop.matching import keypoint_coords
+
+class KLTTracker(object):
+	"""
+	Pyramidal Lucas-Kanade tracking of keypoints from one frame to the next
+
+	Tracks are kept only when they pass a forward-backward consistency check.
+	The detector is run again, away from the surviving tracks, only when the
+	number of tracks drops below min_tracks. Keypoints carry their size, angle
+	and octave along the track so they can still be described with ORB.
+	"""
+
+	def __init__(self, detector=None, min_tracks=150, fb_thresh=1.0, min_distance=10, win_size=(21,21), max_level=3):
+		if detector is None:
+			detector = cv2.ORB_create()
+		self.detector = detector
+		self.min_tracks = min_tracks
+		self.fb_thresh = fb_thresh
+		self.min_distance = min_distance
+		self.lk_params = dict(winSize = win_size, maxLevel = max_level,
+			criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+
+		# frame the keypoints belong to, keypoints and the last tracks
+		self.key = None
+		self.kp = []
+		self.tracks = [[], []]
+
+	def track(self, prev_header, prev_frame, header, frame):
+		"""
+		Tracks the keypoints of prev_frame into frame
+
+		Returns [kp_prev, kp] where kp[i] is where kp_prev[i] landed in frame
+		"""
+		key = FeatureStore.key(header)
+		if (key == self.key):
+			return self.tracks
+
+		if (self.key != FeatureStore.key(prev_header) or len(self.kp) == 0):
+			# the tracker missed the previous frame, seed it again
+			self.kp = list(self.detector.detect(prev_frame, None))
+
+		kp_prev, kp = self.flow(prev_frame, frame, self.kp)
+		self.tracks = [kp_prev, kp]
+		self.kp = kp + self.replenish(frame, kp)
+		self.key = key
+		return self.tracks
+
+	def flow(self, prev_frame, frame, kp_prev):
+		if len(kp_prev) == 0:
+			return [[], []]
+
+		p0 = keypoint_coords(kp_prev).reshape(-1,1,2)
+		p1, st, _ = cv2.calcOpticalFlowPyrLK(prev_frame, frame, p0, None, **self.lk_params)
+		p0r, st_back, _ = cv2.calcOpticalFlowPyrLK(frame, prev_frame, p1, None, **self.lk_params)
+
+		fb = np.linalg.norm((p0 - p0r).reshape(-1,2), axis=1)
+		p1 = p1.reshape(-1,2)
+		height, width = frame.shape[:2]
+		good = (st.ravel() == 1) & (st_back.ravel() == 1) & (fb < self.fb_thresh)
+		good &= (p1[:,0] >= 0) & (p1[:,0] < width) & (p1[:,1] >= 0) & (p1[:,1] < height)
+
+		tracked_prev = []
+		tracked = []
+		for i in np.flatnonzero(good):
+			k = kp_prev[i]
+			tracked_prev.append(k)
+			tracked.append(cv2.KeyPoint(float(p1[i,0]), float(p1[i,1]), k.size, k.angle, k.response, k.octave))
+		return [tracked_prev, tracked]
+
+	def replenish(self, frame, kp):
+		# new keypoints away from the current tracks, only when too few are left
+		if len(kp) >= self.min_tracks:
+			return []
+		mask = np.full(frame.shape[:2], 255, np.uint8)
+		for (x,y) in keypoint_coords(kp):
+			cv2.circle(mask, (int(x),int(y)), self.min_distance, 0, -1)
+		return list(self.detector.detect(frame, mask))
+
+	def reset(self):
+		self.key = None
+		self.kp = []
+		self.tracks = [[], []]
+
+def describe_tracks(detector, frame, kp, kp_prev):
+	"""
+	Descriptors of the tracked keypoints kp in frame
+
+	Keypoints the detector can not describe are dropped from both lists so
+	that kp_prev[i] stays the track of kp[i]. Returns [kp, des, kp_prev, matches]
+	where matches pairs kp[i] with kp_prev[i] like a temporal descriptor match
+	"""
+	for i in range(len(kp)):
+		kp[i].class_id = i
+	kp, des = detector.compute(frame, kp)
+	kp_prev = [kp_prev[k.class_id] for k in kp]
+	matches = [cv2.DMatch(i, i, 0.0) for i in range(len(kp))]
+	return [kp, des, kp_prev, matches]
@@ -0,0 +1,44 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from autobebop.attitude import integrate_attitude, quat_exp, quat_from_euler_zyx, quat_log, quat_multiply, quat_to_dcm, quat_to_euler_zyx
+
+def same_rotation(p, q):
+	# q and -q are the same rotation
+	return np.allclose(p, q, atol=1e-9) or np.allclose(p, -q, atol=1e-9)
+
+def test_quat_exp_matches_scipy():
+	rng = np.random.RandomState(0)
+	rotvecs = np.vstack((rng.normal(0, 0.8, (20,3)), [[0.0, 0.0, 0.0], [1e-8, 0.0, -1e-8]]))
+	q = quat_exp(rotvecs)
+	for i in range(len(rotvecs)):
+		assert same_rotation(q[i], R.from_rotvec(rotvecs[i]).as_quat())
+		assert np.allclose(quat_log(q[i]), rotvecs[i])
+
+def test_multiply_and_dcm_match_scipy():
+	rng = np.random.RandomState(1)
+	p = R.from_rotvec(rng.normal(0, 1, 3))
+	q = R.from_rotvec(rng.normal(0, 1, 3))
+	assert same_rotation(quat_multiply(p.as_quat(), q.as_quat()), (p*q).as_quat())
+	assert np.allclose(quat_to_dcm(q.as_quat()), q.as_matrix() if hasattr(q, 'as_matrix') else q.as_dcm())
+
+def test_integrate_attitude_matches_scipy():
+	rng = np.random.RandomState(2)
+	q0 = R.from_rotvec([0.1, -0.2, 0.3])
+	omega = rng.normal(0, 0.5, (100,3))
+	dt = rng.uniform(0.005, 0.02, 100)
+	out = integrate_attitude(q0.as_quat(), omega, dt)
+	ref = q0
+	for i in range(100):
+		# rates in inertial axes, applied on the left
+		ref = R.from_rotvec(omega[i]*dt[i])*ref
+		assert same_rotation(out[i], ref.as_quat())
+	# a single step gives the same as the first of the stack
+	assert same_rotation(integrate_attitude(q0.as_quat(), omega[0], dt[0]), out[0])
+
+def test_euler_zyx_matches_scipy():
+	rng = np.random.RandomState(3)
+	angles = np.column_stack((rng.uniform(-3, 3, 20), rng.uniform(-1.5, 1.5, 20), rng.uniform(-3, 3, 20)))
+	assert np.allclose(quat_to_euler_zyx(R.from_euler('zyx', angles).as_quat()), angles)
+	q = quat_from_euler_zyx(angles)
+	for i in range(len(angles)):
+		assert same_rotation(q[i], R.from_euler('zyx', angles[i]).as_quat())
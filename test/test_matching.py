@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+from autobebop.matching import keypoint_coords, match_stereo
+
+def shifted_pair(d):
+	# textured left image and the right one shifted d pixels to the right (x2 = x1 + d)
+	rng = np.random.RandomState(0)
+	left = cv2.GaussianBlur(rng.randint(0, 256, (240, 320)).astype(np.uint8), (5,5), 1.5)
+	right = np.zeros_like(left)
+	right[:,d:] = left[:,:-d]
+	return left, right
+
+def features(img):
+	orb = cv2.ORB_create(500)
+	return orb.detectAndCompute(img, None)
+
+def test_match_stereo_shifted_image():
+	left, right = shifted_pair(12)
+	kp1, des1 = features(left)
+	kp2, des2 = features(right)
+	matches = match_stereo(kp1, des1, kp2, des2)
+	assert len(matches) > 100
+	X1 = keypoint_coords(kp1)
+	X2 = keypoint_coords(kp2)
+	q = np.array([m.queryIdx for m in matches])
+	t = np.array([m.trainIdx for m in matches])
+	disparity = X2[t,0] - X1[q,0]
+	assert np.mean(np.abs(disparity - 12) < 1.5) > 0.95
+	assert np.all(np.abs(X2[t,1] - X1[q,1]) < 1.0)
+	# one to one like the cross checked BFMatcher
+	assert len(set(q)) == len(q) and len(set(t)) == len(t)
+
+def test_match_stereo_disparity_range():
+	left, right = shifted_pair(12)
+	kp1, des1 = features(left)
+	kp2, des2 = features(right)
+	matches = match_stereo(kp1, des1, kp2, des2, max_disparity=8.0)
+	X1 = keypoint_coords(kp1)
+	X2 = keypoint_coords(kp2)
+	for m in matches:
+		assert 1.0 < X2[m.trainIdx,0] - X1[m.queryIdx,0] <= 8.0
+
+def test_match_stereo_max_distance():
+	left, right = shifted_pair(12)
+	kp1, des1 = features(left)
+	kp2, des2 = features(right)
+	# no Hamming distance cutoff unless asked for
+	all_matches = match_stereo(kp1, des1, kp2, des2)
+	close = match_stereo(kp1, des1, kp2, des2, max_distance=10)
+	assert max(m.distance for m in all_matches) > 10
+	assert 0 < len(close) < len(all_matches)
+	assert all(m.distance <= 10 for m in close)
+
+def test_match_stereo_empty():
+	kp1, des1 = features(np.zeros((240, 320), np.uint8))
+	assert match_stereo(kp1, des1, kp1, des1) == []
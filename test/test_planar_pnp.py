@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+from autobebop import planar_pnp
+from autobebop.planar_pnp import covariance, homography_poses, reprojection_error, rotation_change, solve
+
+K = np.array([[400.0, 0.0, 320.0], [0.0, 400.0, 240.0], [0.0, 0.0, 1.0]])
+D = np.array([-0.05, 0.01, 0.0, 0.0, 0.0])
+
+# corners of a 1.4 m square gate, with its centre at the origin
+model = np.array([[-0.7, -0.7, 0.0], [0.7, -0.7, 0.0], [0.7, 0.7, 0.0], [-0.7, 0.7, 0.0]])
+
+def view(rvec, tvec):
+	pts, _ = cv2.projectPoints(model, rvec, tvec, K, D)
+	return pts.reshape(-1,2)
+
+def test_solve_recovers_pose():
+	rvec = np.array([[0.2], [-0.5], [0.1]])
+	tvec = np.array([[0.3], [-0.2], [4.0]])
+	pts = view(rvec, tvec)
+	r, t, err = solve(model, pts, K, D)
+	assert err < 1e-3
+	assert rotation_change(r, rvec) < 1e-3
+	assert np.allclose(t, tvec, atol=1e-3)
+	assert np.isclose(reprojection_error(model, pts, r, t, K, D), err)
+
+def test_solve_without_ippe():
+	# the OpenCV 3 path, iterative solves seeded from the homography
+	rvec = np.array([[0.2], [-0.5], [0.1]])
+	tvec = np.array([[0.3], [-0.2], [4.0]])
+	ippe = planar_pnp.ippe
+	planar_pnp.ippe = None
+	try:
+		r, t, err = solve(model, view(rvec, tvec), K, D)
+	finally:
+		planar_pnp.ippe = ippe
+	assert err < 1e-3
+	assert rotation_change(r, rvec) < 1e-3
+	assert np.allclose(t, tvec, atol=1e-3)
+
+def test_solve_from_guess():
+	rvec = np.array([[0.1], [0.3], [0.0]])
+	tvec = np.array([[0.0], [0.1], [3.0]])
+	pts = view(rvec, tvec)
+	r, t, err = solve(model, pts, K, D, guess=(rvec + 0.05, tvec + 0.1))
+	assert err < 1e-3
+	assert rotation_change(r, rvec) < 1e-3
+
+def test_homography_poses():
+	rvec = np.array([[0.2], [-0.5], [0.1]])
+	tvec = np.array([[0.3], [-0.2], [4.0]])
+	poses = homography_poses(model, view(rvec, tvec), K, D)
+	assert len(poses) == 2
+	# the homography pose is exact for noise free corners
+	assert rotation_change(poses[0][0], rvec) < 1e-3
+	assert np.allclose(poses[0][1], tvec, atol=1e-3)
+	# the mirrored one keeps the gate centre and tilts the other way
+	assert np.allclose(poses[1][1], tvec, atol=1e-6)
+	assert rotation_change(poses[1][0], rvec) > 0.1
+
+def test_covariance():
+	rvec = np.array([[0.2], [-0.5], [0.1]])
+	tvec = np.array([[0.3], [-0.2], [4.0]])
+	cov = covariance(model, view(rvec, tvec), rvec, tvec, K, D)
+	assert cov.shape == (6,6)
+	assert np.all(np.diag(cov) > 0)
+	# depth is the least certain translation of a gate seen head on
+	assert cov[2,2] > cov[0,0] and cov[2,2] > cov[1,1]
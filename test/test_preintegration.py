@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+from autobebop.preintegration import Preintegrator
+
+w_body = np.array([0.2, -0.4, 0.6])
+q_start = R.from_rotvec([0.3, 0.1, -0.2])
+
+def attitude(t):
+	# body to inertial attitude turning at the constant body rate w_body
+	return q_start*R.from_rotvec(w_body*t)
+
+def check_rate(rate):
+	pre = Preintegrator()
+	ts = np.arange(0.0, 2.0 + 1e-9, 1.0/rate)
+	for t in ts:
+		pre.add_orientation(t, attitude(t).as_quat())
+	# 20 Hz image stamps over the whole stream, up to its last orientation
+	stamps = np.arange(0.05, ts[-1] + 1e-9, 0.05)
+	for t0, t1 in zip(stamps[:-1], stamps[1:]):
+		out = pre.integrate(t0, t1)
+		assert out is not None, 'interval %f %f not covered at %d Hz' % (t0, t1, rate)
+		dq, dv, cov = out
+		truth = (attitude(t0).inv()*attitude(t1)).as_quat()
+		assert np.allclose(dq, truth, atol=1e-6) or np.allclose(dq, -truth, atol=1e-6)
+		assert np.all(dv == 0)
+		assert cov.shape == (6,6)
+
+def test_orientation_coverage():
+	for rate in (5, 10, 30, 100):
+		check_rate(rate)
+
+def test_interval_before_first_sample():
+	pre = Preintegrator()
+	for t in np.arange(1.0, 2.0, 0.1):
+		pre.add_orientation(t, attitude(t).as_quat())
+	assert pre.integrate(0.5, 1.2) is None
+	assert pre.integrate(1.2, 1.2) is None
+	# nothing known past one period after the last orientation
+	assert pre.integrate(1.9, 2.3) is None
+
+def test_imu_increments():
+	pre = Preintegrator()
+	accel = np.array([0.5, 0.0, -0.2])
+	for t in np.arange(0.0, 1.0, 0.005):
+		pre.add_imu(t, w_body, accel)
+	dq, dv, cov = pre.integrate(0.2, 0.7)
+	assert np.allclose(dq, R.from_rotvec(w_body*0.5).as_quat(), atol=1e-9)
+	# body frame specific force integrated along the rotating body frame
+	dv_ref = np.zeros(3)
+	for t in np.arange(0.2, 0.7 - 1e-9, 0.005):
+		dv_ref = dv_ref + R.from_rotvec(w_body*(t - 0.2)).apply(accel)*0.005
+	assert np.allclose(dv, dv_ref, atol=1e-9)
+	# the covariance grows with the interval
+	_, _, cov_short = pre.integrate(0.2, 0.3)
+	assert np.all(np.diag(cov) > np.diag(cov_short))
@@ -0,0 +1,51 @@
+import numpy as np
+from autobebop.matching import motion_field_rows
+from autobebop.ransac import ransac_motion, ransac_plane
+
+def noisy_plane(rng, n, outliers):
+	# points of the plane 0.2*X - 0.1*Y + 0.5*Z = -1 with outliers in front of it
+	X = rng.uniform(-2, 2, n)
+	Y = rng.uniform(-2, 2, n)
+	Z = (-1.0 - 0.2*X + 0.1*Y)/0.5 + rng.normal(0, 0.005, n)
+	data = np.column_stack((X, Y, Z))
+	data[:outliers] = rng.uniform(-2, 2, (outliers, 3))
+	return data
+
+def test_plane_with_outliers():
+	rng = np.random.RandomState(0)
+	data = noisy_plane(rng, 300, 90)
+	P, res, inlier_no, inliers = ransac_plane(data, 200, 0.02)
+	assert np.allclose(P.ravel(), [0.2, -0.1, 0.5], atol=0.01)
+	assert inliers.shape == (300,)
+	assert inlier_no == inliers.sum()
+	# every plane point is kept, the outliers that happen to lie on it aside
+	assert inliers[90:].mean() > 0.95
+	assert inliers[:90].mean() < 0.1
+
+def test_plane_too_few_points():
+	P, res, inlier_no, inliers = ransac_plane(np.zeros((2,3)), 100, 0.02)
+	assert inlier_no == 0
+	assert not inliers.any()
+
+def test_motion_with_outliers():
+	rng = np.random.RandomState(1)
+	n = 200
+	x = rng.uniform(-0.5, 0.5, n)
+	y = rng.uniform(-0.4, 0.4, n)
+	z = rng.uniform(1, 5, n)
+	V = np.array([0.3, -0.1, 0.8, 0.05, -0.02, 0.1])
+	A = motion_field_rows(x, y, z)
+	Y = np.dot(A, V) + rng.normal(0, 0.002, 2*n)
+	# a third of the features move independently of the camera
+	Y[:2*60] = rng.uniform(-1, 1, 2*60)
+	V_est, res, inlier_no, inliers = ransac_motion(A, Y, 300, 0.02)
+	assert np.allclose(V_est, V, atol=0.01)
+	assert inliers.shape == (n,)
+	assert inliers[60:].mean() > 0.95
+	assert inliers[:60].mean() < 0.1
+
+def test_motion_too_few_points():
+	A = motion_field_rows(np.zeros(2), np.zeros(2), np.ones(2))
+	V, res, inlier_no, inliers = ransac_motion(A, np.zeros(4), 100, 0.02)
+	assert inlier_no == 0
+	assert np.all(V == 0)
@@ -0,0 +1,39 @@
+import numpy as np
+from autobebop.matching import motion_field_rows
+from autobebop.solver import solve_irls
+
+def motion_problem(rng, n, outliers):
+	x = rng.uniform(-0.5, 0.5, n)
+	y = rng.uniform(-0.4, 0.4, n)
+	z = rng.uniform(1, 5, n)
+	V = np.array([0.3, -0.1, 0.8, 0.05, -0.02, 0.1])
+	A = motion_field_rows(x, y, z)
+	Y = np.dot(A, V) + rng.normal(0, 0.002, 2*n)
+	Y[:2*outliers] += rng.uniform(-0.3, 0.3, 2*outliers)
+	return A, Y, V
+
+def test_irls_down_weights_outliers():
+	rng = np.random.RandomState(0)
+	A, Y, V = motion_problem(rng, 200, 20)
+	for loss in ('huber', 'cauchy'):
+		V_est, cov, w = solve_irls(A, Y, loss=loss)
+		assert np.allclose(V_est, V, atol=0.01)
+		assert w.shape == (200,)
+		assert np.median(w[:20]) < 0.5*np.median(w[20:])
+	# plain least squares is pulled away by the same outliers
+	V_ls = np.linalg.lstsq(A, Y, rcond=None)[0]
+	assert np.abs(V_ls - V).max() > np.abs(V_est - V).max()
+
+def test_irls_covariance():
+	rng = np.random.RandomState(1)
+	A, Y, V = motion_problem(rng, 200, 0)
+	V_est, cov, w = solve_irls(A, Y)
+	assert cov.shape == (6,6)
+	assert np.allclose(cov, cov.T)
+	assert np.all(np.linalg.eigvalsh(cov) > 0)
+	# the error is within a few standard deviations
+	assert np.all(np.abs(V_est - V) < 5*np.sqrt(np.diag(cov)))
+
+def test_irls_underdetermined():
+	A = motion_field_rows(np.zeros(3), np.zeros(3), np.ones(3))
+	assert solve_irls(A, np.zeros(6)) == [None, None, None]